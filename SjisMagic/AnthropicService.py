@@ -1,32 +1,42 @@
 import json
 import logging
 import os
-from collections import defaultdict
 
-import anthropic
+from SjisMagic.ProviderRegistry import shared_client
+from utils import parse_response_to_dic, build_batch_prompt
 
 logger = logging.getLogger('translation')
 logger.setLevel(logging.INFO)
 
+MODEL = "claude-3-sonnet-20240229"
+SYSTEM_PROMPT = ("Your job is to translate Japanese phrases from the rhythm game Pop'n Music into English. "
+                 "\nProcess phrases using the following "
+                 "steps:\n\n- If the Japanese is nonsensical, translate it as 'NNN'.\n- If the phrase is meant to be "
+                 "parsed by a program, translate it as 'PPP'.\n- Otherwise translate it to English. \n- Your "
+                 "translations should be as short as possible. Paraphrasing, abbreviation, using incorrect spelling, "
+                 "and symbols are all ok. \n- Your translation should not be longer than the Japanese phrase. Spaces "
+                 "and symbols count towards the length. \n\n\nPlease return the translations as JSON in the "
+                 "following format:\n{ \n  translations:[\n    original:\"\"\n    translation:\"\"\n  ]\n}")
+# The JSON format we ask for already covers several phrases.
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT
 
-def translate(text: str) -> str:
-    client = anthropic.Client(api_key=f"{os.environ['ANTHROPIC_API_KEY']}")
 
-    message = client.messages.create(
-        model="claude-3-sonnet-20240229",
+@shared_client
+def get_client():
+    # The SDK takes a while to import. Only pay for it if we're actually using Claude.
+    import anthropic
+    return anthropic.Client(api_key=f"{os.environ['ANTHROPIC_API_KEY']}")
+
+
+def translate(text: str, context: str = '') -> str:
+    message = get_client().messages.create(
+        model=MODEL,
         max_tokens=1500,
         temperature=0,
-        system="Your job is to translate Japanese phrases from the rhythm game Pop'n Music into English. "
-               "\nProcess phrases using the following "
-               "steps:\n\n- If the Japanese is nonsensical, translate it as 'NNN'.\n- If the phrase is meant to be "
-               "parsed by a program, translate it as 'PPP'.\n- Otherwise translate it to English. \n- Your "
-               "translations should be as short as possible. Paraphrasing, abbreviation, using incorrect spelling, "
-               "and symbols are all ok. \n- Your translation should not be longer than the Japanese phrase. Spaces "
-               "and symbols count towards the length. \n\n\nPlease return the translations as JSON in the following"
-               "format:\n{ \n  translations:[\n    original:\"\"\n    translation:\"\"\n  ]\n}",
+        system=SYSTEM_PROMPT,
         messages=[{
             "role": "user",
-            "content": f'Translate "{text}". Do not use more than {len(text)} characters.'
+            "content": f'Translate "{text}". Do not use more than {len(text)} characters.{context}'
         }
         ]
     )
@@ -38,15 +48,22 @@ def translate(text: str) -> str:
     return translated_string
 
 
-def parse_response_to_dic(response_text):
-    # Parse the json we received into a dictionary
-    json_array = json.loads(response_text)
-    translation_dic = defaultdict()
-
-    for item in json_array["translations"]:
-        original = item["original"]
-        translation = item["translation"]
-        translation_dic[original] = translation
+def translate_batch(texts: list) -> dict:
+    """
+    Translate several phrases with a single request.
+    :return: Dictionary of original phrase to translation. Phrases the model skipped won't be in it.
+    """
+    message = get_client().messages.create(
+        model=MODEL,
+        max_tokens=4000,
+        temperature=0,
+        system=SYSTEM_PROMPT,
+        messages=[{
+            "role": "user",
+            "content": build_batch_prompt(texts)
+        }
+        ]
+    )
 
-    logger.debug(f"Translated: {translation_dic}")
-    return translation_dic
+    logger.debug(f"response: {message}")
+    return parse_response_to_dic(message.content[0].text)
@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import os
+import time
+
+from decouple import config
+from peewee import *
+
+logger = logging.getLogger('cache')
+logger.setLevel(logging.INFO)
+
+# The cache lives in its own file, so it survives wiping the main DB for a new game build.
+cache_enabled = config('LLM_CACHE_ENABLED', default=True, cast=bool)
+cache_path = config('LLM_CACHE_PATH', default='database/llmCache.db')
+cache_max_entries = config('LLM_CACHE_MAX_ENTRIES', default=500_000, cast=int)
+
+# Don't count rows on every write. Check for eviction every so often instead.
+eviction_interval = 1_000
+
+cache_db = SqliteDatabase(None)
+
+stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+_writes_since_eviction = 0
+
+
+class CachedResponse(Model):
+    cache_key = CharField(primary_key=True)
+    brain = TextField()
+    model_name = TextField()
+    prompt_hash = TextField()
+    text = TextField()
+    response = TextField()
+    last_used = FloatField(index=True)
+
+    class Meta:
+        database = cache_db
+
+
+def setup_cache():
+    if not cache_enabled:
+        logger.info('LLM response cache disabled.')
+        return
+
+    cache_folder = os.path.dirname(cache_path)
+    if cache_folder and not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    logger.info(f'Connecting LLM response cache: {cache_path}')
+    # WAL, so several workers can share the cache.
+    cache_db.init(cache_path, pragmas={'journal_mode': 'wal'})
+    cache_db.connect(reuse_if_open=True)
+    cache_db.create_tables([CachedResponse])
+    logger.info(f'{CachedResponse.select().count():,} cached responses.')
+    evict()
+
+
+def is_active() -> bool:
+    return cache_enabled and cache_db.database is not None
+
+
+def hash_prompt(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+
+
+def make_key(brain: str, model_name: str, prompt_hash: str, text: str) -> str:
+    # Null separators, so no combination of fields can collide with another.
+    key_material = '\x00'.join([brain, model_name, prompt_hash, text])
+    return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
+
+
+def get(brain: str, model_name: str, system_prompt: str, text: str):
+    """
+    Look up a response we already paid for.
+    :return: The cached response, or None on a miss.
+    """
+    if not is_active():
+        return None
+
+    cache_key = make_key(brain, model_name, hash_prompt(system_prompt), text)
+    cached = CachedResponse.get_or_none(CachedResponse.cache_key == cache_key)
+    if cached is None:
+        stats['misses'] += 1
+        return None
+
+    stats['hits'] += 1
+    CachedResponse.update(last_used=time.time()).where(CachedResponse.cache_key == cache_key).execute()
+    logger.debug(f'Cache hit: "{text}"')
+    return cached.response
+
+
+def put(brain: str, model_name: str, system_prompt: str, text: str, response: str):
+    global _writes_since_eviction
+    if not is_active():
+        return
+
+    prompt_hash = hash_prompt(system_prompt)
+    CachedResponse.replace(cache_key=make_key(brain, model_name, prompt_hash, text),
+                           brain=brain,
+                           model_name=model_name,
+                           prompt_hash=prompt_hash,
+                           text=text,
+                           response=response,
+                           last_used=time.time()).execute()
+    stats['writes'] += 1
+
+    _writes_since_eviction += 1
+    if _writes_since_eviction >= eviction_interval:
+        evict()
+
+
+def evict():
+    """
+    Drop the least recently used responses until we're back under the size limit.
+    """
+    global _writes_since_eviction
+    _writes_since_eviction = 0
+
+    overflow = CachedResponse.select().count() - cache_max_entries
+    if overflow <= 0:
+        return
+
+    stale_keys = (CachedResponse.select(CachedResponse.cache_key)
+                  .order_by(CachedResponse.last_used)
+                  .limit(overflow))
+    evicted = CachedResponse.delete().where(CachedResponse.cache_key.in_(stale_keys)).execute()
+    stats['evictions'] += evicted
+    logger.info(f'Evicted {evicted:,} least recently used responses.')
+
+
+def log_stats():
+    if not is_active():
+        return
+
+    lookups = stats['hits'] + stats['misses']
+    hit_rate = stats['hits'] / lookups * 100 if lookups else 0
+    logger.info(f"Cache hits: {stats['hits']:,} Misses: {stats['misses']:,} ({hit_rate:.0f}% hit rate)")
+    logger.info(f"Cache writes: {stats['writes']:,} Evictions: {stats['evictions']:,}")
@@ -1,14 +1,22 @@
 import asyncio
+import mmap
+import os
 import re
+import time
+from collections import defaultdict
 from enum import Enum
-from typing import Callable
 
 import unicodedata
+from decouple import config
 
 import utils
-from SjisMagic import OpenAIService, AnthropicService, OllamaService
+from SjisMagic import CacheService, EnsembleService, Metrics, ProviderRegistry, SjisExtractor, ValidatorRegistry
+from SjisMagic.PatternMatcher import count_occurrences
+from SjisMagic.RateLimiter import ProviderScheduler, estimate_tokens
+from SjisMagic.TranslationMemory import TranslationMemory
+from SjisMagic.TranslationWriter import TranslationWriter
 from SjisMagic.DatabaseService import *
-from SjisMagic.DatabaseService import exclude_string
+from SjisMagic.DatabaseService import exclude_strings_in_bulk
 from utils import announce_status
 
 logger = logging.getLogger('dataprocessor')
@@ -24,11 +32,67 @@ class Brain(Enum):
     Ollama = 4
 
 
-async def crank_up_translation_machine(batch_size=100):
+# The provider SDK calls block, so each brain gets its own scheduler and thread pool. The pool size is the number of
+# requests we'll allow in flight against that provider at once. Local models usually can't take as many as the hosted
+# APIs. Request/token limits per minute are set with <BRAIN>_REQUESTS_PER_MINUTE and <BRAIN>_TOKENS_PER_MINUTE.
+max_in_flight = {
+    Brain.ChatGPT: config('CHATGPT_MAX_IN_FLIGHT', default=8, cast=int),
+    Brain.Claude: config('CLAUDE_MAX_IN_FLIGHT', default=8, cast=int),
+    Brain.Google: config('GOOGLE_MAX_IN_FLIGHT', default=8, cast=int),
+    Brain.Ollama: config('OLLAMA_MAX_IN_FLIGHT', default=2, cast=int),
+}
+max_retries = config('MAX_RETRIES', default=4, cast=int)
+_schedulers = {}
+
+
+def get_scheduler(brain: Brain) -> ProviderScheduler:
+    """
+    Fetch the scheduler for a brain, creating it the first time it's needed.
+    """
+    if brain not in _schedulers:
+        brain_setting = brain.name.upper()
+        _schedulers[brain] = ProviderScheduler(
+            brain.name,
+            max_in_flight=max_in_flight[brain],
+            requests_per_minute=config(f'{brain_setting}_REQUESTS_PER_MINUTE', default=0, cast=int),
+            tokens_per_minute=config(f'{brain_setting}_TOKENS_PER_MINUTE', default=0, cast=int),
+            max_retries=max_retries)
+    return _schedulers[brain]
+
+
+# Multi-phrase prompts. Packing phrases into one request saves sending the system prompt over and over.
+# 1 phrase per prompt sends every phrase on its own.
+prompt_max_phrases = config('PROMPT_MAX_PHRASES', default=1, cast=int)
+prompt_char_budget = config('PROMPT_CHAR_BUDGET', default=600, cast=int)
+prompt_max_attempts = config('PROMPT_MAX_ATTEMPTS', default=3, cast=int)
+
+# Worker mode. A row that's been leased this many times without getting translated is left for a human to look at.
+max_lease_attempts = config('MAX_LEASE_ATTEMPTS', default=3, cast=int)
+
+# Ensemble mode. Every phrase goes to all of these brains at once (e.g. ENSEMBLE_BRAINS=Ollama,ChatGPT,Claude) and
+# the best answer wins. Once an answer scores ENSEMBLE_GOOD_ENOUGH, we stop waiting for the others. Swap
+# ensemble_scorer for your own to change what "best" means.
+ensemble_brains = [Brain[brain_name.strip()] for brain_name in config('ENSEMBLE_BRAINS', default='').split(',')
+                   if brain_name.strip()]
+ensemble_good_enough = config('ENSEMBLE_GOOD_ENOUGH', default=3, cast=float)
+ensemble_scorer = EnsembleService.score_translation
+
+# While the translation machine runs, results go through a single writer instead of saving one row at a time.
+_writer = None
+
+# Translation memory. Strings that only differ from an earlier one by numbers, width or punctuation reuse its
+# translation. Up to TRANSLATION_MEMORY_CONTEXT similar earlier translations get shown to the brain, 0 = don't.
+translation_memory_enabled = config('TRANSLATION_MEMORY', default=True, cast=bool)
+translation_memory_context = config('TRANSLATION_MEMORY_CONTEXT', default=3, cast=int)
+_memory = None
+
+
+async def crank_up_translation_machine(batch_size=100, brain=Brain.Ollama):
     """
     Look for stuff in the DB that needs translation or other work. Then start queuing up tasks, so we can get it
     done. :param batch_size: We'll query and queue items in small batches for monitoring, performance testing,
     etc. The entire batch gets queued up and translation runs in parallel.
+    :param brain: Which brain does the translating.
     """
     utils.announce_status('Starting translation machine')
 
@@ -42,104 +106,503 @@ async def crank_up_translation_machine(batch_size=100):
     else:
         logger.info(f"We'll handle em in batches of {batch_size:,}.")
 
+    if ensemble_brains:
+        logger.info(f'Ensemble of {", ".join(brain.name for brain in ensemble_brains)}.')
+    elif prompt_max_phrases > 1:
+        logger.info(f'Sending up to {prompt_max_phrases} phrases ({prompt_char_budget:,} chars) per request.')
+
     # Get all things that need translating
-    translateables = get_untranslated_items(-1)
-    for translateable in chunked(translateables, batch_size):
-        with sqlite_db.atomic():
+    # Pull the whole list up front. The writer updates these rows while we go, and SQLite doesn't like a table changing
+    # under an open cursor.
+    translateables = list(get_untranslated_items(-1))
+    total_requests = 0
+    start_time = time.time()
+
+    load_translation_memory()
+    start_writer()
+    try:
+        for translateable in chunked(translateables, batch_size):
             logger.info(f'Processing {len(translateable)} strings.')
-            taskset = set()
-            # Put it in the queue
-            for trans in translateable:
-                # Do we need a translation?
-                if trans.translation == '':
-                    task_translate = asyncio.create_task(translate_and_save(trans, Brain.Ollama))
-                    taskset.add(task_translate)
-
-            # Log any errors.
-            # We don't break, too annoying to set it off on 10k+ translations and have it fail on 5,000...
-            results = await (asyncio.gather(*taskset, return_exceptions=True))
-            for i, result in enumerate(results, start=1):
-                if isinstance(result, Exception):
-                    logger.warning(f"Error on task {i}: {result}")
+            batch_start_time = time.time()
 
-    else:
-        logger.info(f'No more items to queue!')
+            # Do we need a translation?
+            pending = [trans for trans in translateable if trans.translation == '']
+            request_count = await translate_pending(pending, brain)
+
+            total_requests += request_count
+            log_throughput('Batch', request_count, time.time() - batch_start_time)
+
+        else:
+            logger.info(f'No more items to queue!')
+    finally:
+        await stop_writer()
+
+    log_throughput('Total', total_requests, time.time() - start_time)
+    log_run_stats()
+
+
+async def run_translation_worker(worker_id: str, brain=Brain.Ollama, lease_size=50, lease_seconds=600,
+                                 poll_seconds=10):
+    """
+    Worker mode. Run as many of these as you like, in as many processes as you like, against the same DB. Each worker
+    leases a chunk of untranslated rows, translates them, saves them, and goes back for more. Leases from workers that
+    died expire and get picked up by someone else.
+    :param worker_id: Unique name for this worker. Host + pid works.
+    :param lease_size: Rows per lease.
+    :param lease_seconds: How long a lease lasts. Has to be longer than translating a lease takes, or someone else
+    will pick the rows up too.
+    :param poll_seconds: How long to wait before checking again, when everything left is leased by other workers.
+    """
+    utils.announce_status(f'Starting translation worker {worker_id}')
+
+    total_requests = 0
+    start_time = time.time()
+
+    load_translation_memory()
+    start_writer()
+    try:
+        while True:
+            leased = lease_untranslated_items(worker_id, lease_size, lease_seconds, max_lease_attempts)
+            if not leased:
+                # Other workers might still die on us. Hang around until their leases are done or expired.
+                if get_leased_items_count(max_lease_attempts) == 0:
+                    break
+                logger.info(f'Everything left is leased by other workers. Checking again in {poll_seconds}s.')
+                await asyncio.sleep(poll_seconds)
+                continue
+
+            logger.info(f'Leased {len(leased)} strings.')
+            batch_start_time = time.time()
+            request_count = await translate_pending(leased, brain)
+            # Commit before we take another lease.
+            await _writer.wait_until_saved()
+
+            total_requests += request_count
+            log_throughput('Lease', request_count, time.time() - batch_start_time)
+    finally:
+        await stop_writer()
+
+    logger.info(f'No more work for {worker_id}!')
+    log_throughput('Total', total_requests, time.time() - start_time)
+    log_run_stats()
+
+
+async def translate_pending(translations: list, brain) -> int:
+    """
+    Translate a batch of rows, one phrase per request or packed into multi-phrase requests.
+    :return: Number of requests made.
+    """
+    translations = reuse_remembered_translations(translations)
+    if not translations:
+        return 0
+
+    # Ensembles compare answers phrase by phrase, so they always send one phrase per request.
+    if prompt_max_phrases > 1 and not ensemble_brains:
+        return await translate_in_prompt_batches(translations, brain)
+    return await translate_one_by_one(translations, brain)
+
+
+def log_throughput(label: str, request_count: int, elapsed_time: float):
+    requests_per_sec = request_count / elapsed_time if elapsed_time else 0
+    logger.info(f'{label}: {request_count:,} requests in {elapsed_time:,.2f} seconds. ({requests_per_sec:,.2f} req/sec)')
+
+
+async def translate_one_by_one(translations: list, brain) -> int:
+    """
+    Translate each phrase with its own request.
+    :return: Number of requests made.
+    """
+    taskset = set()
+    # Put it in the queue
+    for trans in translations:
+        task_translate = asyncio.create_task(translate_and_save(trans, brain))
+        taskset.add(task_translate)
+
+    # Log any errors.
+    # We don't break, too annoying to set it off on 10k+ translations and have it fail on 5,000...
+    results = await (asyncio.gather(*taskset, return_exceptions=True))
+    for i, result in enumerate(results, start=1):
+        if isinstance(result, Exception):
+            logger.warning(f"Error on task {i}: {result}")
+
+    return len(taskset)
+
+
+async def translate_in_prompt_batches(translations: list, brain) -> int:
+    """
+    Pack phrases into multi-phrase requests. Anything the replies skip gets packed into a later request, until we run
+    out of attempts.
+    :return: Number of requests made.
+    """
+    request_count = 0
+    pending = translations
+    for attempt in range(1, prompt_max_attempts + 1):
+        if not pending:
+            break
+
+        prompt_batches = list(build_prompt_batches(pending, prompt_char_budget, prompt_max_phrases))
+        results = await asyncio.gather(*[translate_batch_and_save(prompt_batch, brain)
+                                         for prompt_batch in prompt_batches], return_exceptions=True)
+        request_count += len(prompt_batches)
+
+        pending = []
+        for prompt_batch, result in zip(prompt_batches, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Error on request for {len(prompt_batch)} phrases: {result}")
+                pending.extend(prompt_batch)
+            else:
+                pending.extend(result)
+
+        if pending:
+            logger.info(f'{len(pending):,} phrases missing from replies after attempt {attempt}.')
+
+    if pending:
+        logger.warning(f'Gave up on {len(pending):,} phrases after {prompt_max_attempts} attempts.')
+
+    return request_count
+
+
+def build_prompt_batches(translations: list, char_budget: int, max_phrases: int):
+    """
+    Split translations into groups for multi-phrase requests. A group closes when the next phrase would push it over
+    the character budget or the phrase limit. A phrase bigger than the whole budget gets a request to itself.
+    """
+    prompt_batch = []
+    batch_chars = 0
+    for trans in translations:
+        text_chars = len(trans.extracted_text)
+        if prompt_batch and (batch_chars + text_chars > char_budget or len(prompt_batch) >= max_phrases):
+            yield prompt_batch
+            prompt_batch = []
+            batch_chars = 0
+
+        prompt_batch.append(trans)
+        batch_chars += text_chars
+
+    if prompt_batch:
+        yield prompt_batch
+
+
+def get_service(brain):
+    """
+    Fetch the service module that talks to a brain. The first call for a brain loads its SDK.
+    """
+    return ProviderRegistry.get_provider(brain.name)
 
 
 async def translate_and_save(trans: Translation, brain):
-    if brain == Brain.ChatGPT:
-        trans.translation = OpenAIService.translate(trans.extracted_text)
-        logger.debug(f'Translated (GPT): "{trans.extracted_text}" to "{trans.translation}"')
-    elif brain == Brain.Claude:
-        trans.translation = AnthropicService.translate(trans.extracted_text)
-        logger.debug(f'Translated (Claude): "{trans.extracted_text}" to "{trans.translation}"')
-    elif brain == Brain.Google:
-        raise NotImplemented
-    elif brain == Brain.Ollama:
-        trans.translation = OllamaService.translate(trans.extracted_text)
-        logger.debug(f'Translated (Ollama): "{trans.extracted_text}" to "{trans.translation}"')
+    if ensemble_brains:
+        trans.translation = await translate_with_ensemble(trans.extracted_text)
     else:
-        logger.error(f'Unknown brain {brain}')
+        trans.translation = await request_translation(trans.extracted_text, brain,
+                                                      get_similar_translations_prompt(trans.extracted_text))
+
+    remember_translation(trans)
+    save_translation(trans)
+
 
-    trans.save()
+async def request_translation(text: str, brain, context: str = '') -> str:
+    service = get_service(brain)
 
+    # Did we already pay for this one?
+    cached_translation = CacheService.get(brain.name, service.MODEL, service.SYSTEM_PROMPT, text)
+    if cached_translation is not None:
+        logger.debug(f'Cached ({brain.name}): "{text}" to "{cached_translation}"')
+        return cached_translation
 
-def exclude_strings(exclusion_reason: str, excluder: Callable, *kwargs):
+    # Run the blocking SDK call on the brain's pool, so the event loop is free to start the next one.
+    # The context only nudges wording, so it stays out of the cache key.
+    translation = await get_scheduler(brain).run(
+        service.translate, text, context, tokens=estimate_tokens(service.SYSTEM_PROMPT, text, context, text),
+        chars=len(service.SYSTEM_PROMPT) + len(text) + len(context))
+    logger.debug(f'Translated ({brain.name}): "{text}" to "{translation}"')
+    CacheService.put(brain.name, service.MODEL, service.SYSTEM_PROMPT, text, translation)
+    return translation
+
+
+async def translate_with_ensemble(text: str) -> str:
     """
-    Test all strings in the DB against the given function.
-    :param exclusion_reason: Reason to list in DB  for why these strings are excluded
-    :param excluder: Function to test string against. True = exclude, False = include
+    Ask every brain in the ensemble at once, and keep the best answer.
     """
-    announce_status(f"Excluding strings via function {excluder}.")
+    context = get_similar_translations_prompt(text)
+    _, translation, _ = await EnsembleService.race(
+        text, {brain.name: request_translation(text, brain, context) for brain in ensemble_brains},
+        scorer=ensemble_scorer, good_enough=ensemble_good_enough)
+    return translation
 
-    non_excluded_strings = Translation.select().where(Translation.exclude_from_translation == 0).count()
-    logger.info(f'Reviewing {non_excluded_strings:,} strings.')
 
-    exclusion_count = 0
-    # Let's go through em all.
-    stuff_to_review = Translation.select().where(Translation.exclude_from_translation == 0)
-    with sqlite_db.atomic():
-        for item in stuff_to_review:
-            jap_text = item.extracted_text
-            # Test string against our exclusion function
-            if not excluder(jap_text, *kwargs):
-                exclude_string(jap_text, exclusion_reason)
-                exclusion_count += 1
+def load_translation_memory():
+    """
+    Fill the translation memory with everything we've translated so far.
+    """
+    global _memory
+    if not translation_memory_enabled:
+        _memory = None
+        return
+
+    _memory = TranslationMemory()
+    for extracted_text, translation in get_translated_items():
+        _memory.add(extracted_text, translation)
+    logger.info(f'Loaded {len(_memory.entries):,} translations into translation memory.')
+
+
+def log_run_stats():
+    # Every brain that got used, including the ensemble's.
+    for scheduler in _schedulers.values():
+        scheduler.log_dead_letters()
+    if ensemble_brains:
+        EnsembleService.log_stats()
+        Metrics.add_section('ensemble', dict(EnsembleService.stats))
+    if _memory is not None:
+        _memory.log_stats()
+        Metrics.add_section('translation_memory', {'entries': len(_memory.entries), **_memory.stats})
+
+
+def reuse_remembered_translations(translations: list) -> list:
+    """
+    Save a translation for every row the translation memory already covers.
+    :return: The rows that still need a brain.
+    """
+    if _memory is None:
+        return translations
+
+    remaining = []
+    for trans in translations:
+        remembered_translation = _memory.lookup(trans.extracted_text)
+        if remembered_translation is None:
+            remaining.append(trans)
+            continue
+
+        trans.translation = remembered_translation
+        logger.debug(f'Remembered: "{trans.extracted_text}" to "{trans.translation}"')
+        save_translation(trans)
+
+    return remaining
+
+
+def remember_translation(trans: Translation):
+    if _memory is not None:
+        _memory.add(trans.extracted_text, trans.translation)
+
+
+def get_similar_translations_prompt(text: str) -> str:
+    """
+    Show the brain how we translated similar strings, so it stays consistent with them.
+    """
+    if _memory is None or translation_memory_context <= 0:
+        return ''
+    return utils.build_context_prompt(_memory.find_similar(text, translation_memory_context))
+
+
+def start_writer():
+    global _writer
+    _writer = TranslationWriter()
+    _writer.start()
+
+
+async def stop_writer():
+    global _writer
+    await _writer.close()
+    _writer = None
+
+
+def save_translation(trans: Translation):
+    # Hand it to the writer if the translation machine is running. Saving happens on the event loop thread either way,
+    # DB connections stay put.
+    if _writer is not None:
+        _writer.submit(trans.extracted_text, trans.translation)
+    else:
+        trans.save()
+
 
+async def translate_batch_and_save(translations: list, brain) -> list:
+    """
+    Translate several phrases with one request, and save whatever came back.
+    :return: The translations the reply didn't cover.
+    """
+    service = get_service(brain)
+
+    # Only send the phrases we haven't already paid for.
+    uncached = []
+    for trans in translations:
+        cached_translation = CacheService.get(brain.name, service.MODEL, service.BATCH_SYSTEM_PROMPT,
+                                              trans.extracted_text)
+        if cached_translation is None:
+            uncached.append(trans)
+            continue
+
+        trans.translation = cached_translation
+        logger.debug(f'Cached ({brain.name}): "{trans.extracted_text}" to "{trans.translation}"')
+        remember_translation(trans)
+        save_translation(trans)
+
+    if not uncached:
+        return []
+    translations = uncached
+
+    texts = [trans.extracted_text for trans in translations]
+    # The reply repeats every phrase next to its translation. Count them all against the token budget.
+    translation_dic = await get_scheduler(brain).run(
+        service.translate_batch, texts,
+        tokens=estimate_tokens(service.BATCH_SYSTEM_PROMPT, *texts, *texts, *texts),
+        chars=len(service.BATCH_SYSTEM_PROMPT) + sum(len(text) for text in texts))
+
+    # Models like to tidy up the original they echo back. Fall back to a looser match before giving up on a phrase.
+    loose_translation_dic = {to_standard_width(original).strip(): translation
+                             for original, translation in translation_dic.items()}
+
+    missing = []
+    for trans in translations:
+        translation = translation_dic.get(trans.extracted_text)
+        if translation is None:
+            translation = loose_translation_dic.get(to_standard_width(trans.extracted_text).strip())
+
+        if not translation:
+            missing.append(trans)
+            continue
+
+        trans.translation = translation
+        logger.debug(f'Translated ({brain.name}): "{trans.extracted_text}" to "{trans.translation}"')
+        CacheService.put(brain.name, service.MODEL, service.BATCH_SYSTEM_PROMPT, trans.extracted_text,
+                         trans.translation)
+        remember_translation(trans)
+        save_translation(trans)
+
+    return missing
+
+
+def exclude_strings_via_validators(validators: list):
+    """
+    Test all strings in the DB that haven't been validated yet against the validators. Each validator sweeps over
+    whatever the ones before it let through, cheapest per rejection first (see ValidatorRegistry), so a string is
+    excluded for the first one it fails. Exclusions are written back in one bulk update.
+    :param validators: Validators, or (exclusion_reason, validator) pairs. Validators return True = include,
+    False = exclude
+    """
+    announce_status(f"Excluding strings via {len(validators)} validators.")
+    start_time = time.time()
+
+    # Strings from earlier runs already passed. Only the new ones need a look.
+    stuff_to_review = get_unvalidated_texts()
+    logger.info(f'Reviewing {len(stuff_to_review):,} strings.')
+
+    validators = ValidatorRegistry.order_validators(validators, stuff_to_review)
+    exclusions, exclusion_counts = find_exclusions(stuff_to_review, validators)
+    exclude_strings_in_bulk(exclusions)
+
+    for exclusion_reason, exclusion_count in exclusion_counts.items():
         logger.info(f'Excluded {exclusion_count:,} strings. Reason: {exclusion_reason}')
+    logger.info(f'Reviewed {len(stuff_to_review):,} strings in {time.time() - start_time:,.2f} seconds.')
 
 
-def exclude_unfindable_strings(source_file, text_codec):
-    announce_status(f"Examining '{source_file}' to ensure extracted strings are present.")
-    # We'll look to make sure our strings exist in this file
-    with open(source_file, 'rb') as f:
-        contents = f.read()
+def find_exclusions(texts, validators: list):
+    """
+    Run strings through the validators, in order. One sweep per validator, over the strings that passed the ones
+    before it, so a string is excluded for the first one it fails.
+    :param validators: Validators, or (exclusion_reason, validator) pairs. Validators return True = include,
+    False = exclude
+    :return: (list of (exclusion_reason, text) pairs, dictionary of exclusion_reason to count)
+    """
+    validators = [ValidatorRegistry.Validator(*validator) for validator in validators]
+    exclusions = []
+    exclusion_counts = {validator.exclusion_reason: 0 for validator in validators}
+    # Each sweep gets its own timer.
+    remaining_texts = texts
+    for validator in validators:
+        with Metrics.stage(f'validate: {validator.exclusion_reason}'):
+            passed_texts = []
+            for jap_text, verdict in zip(remaining_texts, ValidatorRegistry.run_validator(validator, remaining_texts)):
+                if verdict:
+                    passed_texts.append(jap_text)
+                else:
+                    exclusions.append((validator.exclusion_reason, jap_text))
+                    exclusion_counts[validator.exclusion_reason] += 1
+            remaining_texts = passed_texts
+
+    return exclusions, exclusion_counts
+
+
+def exclude_unfindable_strings(source_file, text_codec) -> dict:
+    """
+    Make sure every non-excluded string that hasn't been validated yet actually exists in the source file. All the
+    strings get matched in one pass over the (memory-mapped) file.
+    :return: Dictionary of string to number of occurrences in the source file.
+    """
+    return exclude_unfindable_strings_in_files([source_file], text_codec)
 
-    non_excluded_strings = Translation.select().where(Translation.exclude_from_translation == 0).count()
-    logger.info(f'Reviewing {non_excluded_strings:,} strings.')
 
-    exclusion_count = 0
-    error_count = 0
-    # Let's go through em all.
-    stuff_to_review = Translation.select().where(Translation.exclude_from_translation == 0)
-    with sqlite_db.atomic():
-        # Make sure to catch exceptions here. If we fucked up our encoding/decoding somewhere, it'll show up here.
-        for phrase in [x.extracted_text.encode(text_codec) for x in stuff_to_review]:
+def exclude_unfindable_strings_in_files(source_files: list, text_codec) -> dict:
+    """
+    Same as exclude_unfindable_strings, for a batch of files. Each string only gets looked for in the files it was
+    extracted from. Strings we don't know the source of get looked for in all of them.
+    :param text_codec: One codec, or several comma separated. Strings get looked for in every one of them.
+    :return: Dictionary of string to number of occurrences across the files.
+    """
+    announce_status(f"Examining {len(source_files):,} source files to ensure extracted strings are present.")
+    start_time = time.time()
+
+    stuff_to_review = get_unvalidated_texts()
+    logger.info(f'Reviewing {len(stuff_to_review):,} strings.')
+
+    exclusions = []
+    # One phrase per codec that gives different bytes. searchable_texts says which string each phrase is.
+    phrases = []
+    searchable_texts = []
+    codecs = SjisExtractor.get_codecs(text_codec)
+    # Make sure to catch exceptions here. If we fucked up our encoding/decoding somewhere, it'll show up here.
+    for text in stuff_to_review:
+        encoded_texts = set()
+        for codec in codecs:
             try:
-                # Make sure the data is actually in the file.
-                # If we can't match the string to the source file... we fucked up somewhere.
-                if contents.find(phrase) == -1:
-                    logger.debug(f"Unable to relocate extracted string in original file: {phrase.decode(text_codec)}")
-                    exclude_string(phrase, 'Missing in Source File')
-                    exclusion_count += 1
-
+                encoded_texts.add(text.encode(codec))
             except Exception as e:
-                logger.debug(f"Error checking for '{phrase}' in source: {e.__class__.__name__}")
-                exclude_string(phrase, "Error Checking Source File")
-                error_count += 1
-
-    logger.info(f"Excluded {exclusion_count:,} strings. Reason: Missing in source.")
+                encode_error = e
+        if not encoded_texts:
+            logger.debug(f"Error checking for '{text}' in source: {encode_error.__class__.__name__}")
+            exclusions.append(("Error Checking Source File", text))
+        for encoded_text in encoded_texts:
+            phrases.append(encoded_text)
+            searchable_texts.append(text)
+    error_count = len(exclusions)
+
+    # Which phrases to look for in which file
+    file_phrase_indexes = {}
+    known_texts = set()
+    for source_file in source_files:
+        occurring_texts = get_occurring_texts(get_source_file(source_file))
+        file_phrase_indexes[source_file] = [index for index, text in enumerate(searchable_texts)
+                                            if text in occurring_texts]
+        known_texts.update(occurring_texts)
+    unknown_indexes = [index for index, text in enumerate(searchable_texts) if text not in known_texts]
+
+    counts = [0] * len(phrases)
+    for source_file, phrase_indexes in file_phrase_indexes.items():
+        phrase_indexes = phrase_indexes + unknown_indexes
+        # An empty file can't be mapped, and has nothing in it anyway. (Batch mode picks up stuff like .gitkeep)
+        if not phrase_indexes or os.path.getsize(source_file) == 0:
+            continue
+        with open(source_file, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                file_counts = count_occurrences([phrases[index] for index in phrase_indexes], contents)
+        for index, count in zip(phrase_indexes, file_counts):
+            counts[index] += count
+
+    occurrences = defaultdict(int)
+    for text, count in zip(searchable_texts, counts):
+        occurrences[text] += count
+    for text, count in occurrences.items():
+        # If we can't match the string to the source file... we fucked up somewhere.
+        if count == 0:
+            logger.debug(f"Unable to relocate extracted string in original file: {text}")
+            exclusions.append(('Missing in Source File', text))
+
+    exclude_strings_in_bulk(exclusions)
+
+    logger.info(f"Excluded {len(exclusions) - error_count:,} strings. Reason: Missing in source.")
     logger.info(f"Excluded {error_count:,} strings. Reason: Error checking source.")
+    logger.info(f"Found {sum(counts):,} occurrences of {len(occurrences):,} strings in {time.time() - start_time:,.2f} "
+                f"seconds.")
+    return dict(occurrences)
 
 
 def convert_everythings_width(width: str):
@@ -201,9 +664,7 @@ def to_standard_width(full_width_string):
 def cull_translations(translation_dic: dict):
     logger.debug(f"Culling translations: {translation_dic}")
 
-    unwanted_things = {'NNN', 'PPP', 'CCC'}  # better membership test than list
-
-    keys_to_remove = [key for key, value in translation_dic.items() if value in unwanted_things]
+    keys_to_remove = [key for key, value in translation_dic.items() if utils.is_placeholder(value)]
     for key in keys_to_remove:
         del translation_dic[key]
 
@@ -292,11 +753,30 @@ def calc_japanese_percentage(input_string):
         return 0  # Return 0% if the input string is empty or None
 
     total_chars = len(input_string)
-    japanese_chars = sum(is_char_japanese(char) for char in input_string)
+    # Every char maps to \x00 or \x01 through the lookup table. Then we just count.
+    # Anything past the end of the table is left as is, and can't be Japanese anyway.
+    japanese_chars = input_string.translate(get_japanese_char_table()).count('\x01')
 
     return (japanese_chars / total_chars) * 100
 
 
+# Covers the BMP and the supplementary ideographic planes. Nothing past plane 3 passes is_char_japanese.
+japanese_char_table_size = 0x40000
+_japanese_char_table = None
+
+
+def get_japanese_char_table() -> bytes:
+    """
+    Lookup table of is_char_japanese for every codepoint in range. 1 = Japanese, 0 = not.
+    Built on first use. Takes a fraction of a second, then it's a lot cheaper than asking unicodedata per char.
+    """
+    global _japanese_char_table
+    if _japanese_char_table is None:
+        _japanese_char_table = bytes(is_char_japanese(chr(codepoint))
+                                     for codepoint in range(japanese_char_table_size))
+    return _japanese_char_table
+
+
 def is_char_japanese(char):
     """Check if a character is Japanese."""
     # Check for Hiragana and Katakana
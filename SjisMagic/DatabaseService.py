@@ -1,7 +1,10 @@
 import logging
 import os
+import time
 
+from decouple import config
 from peewee import *
+from playhouse.migrate import SqliteMigrator, migrate
 from playhouse.sqlite_ext import SqliteExtDatabase
 
 logger = logging.getLogger('database')
@@ -11,8 +14,19 @@ database_folder = 'database'
 database_name = 'sjisMagic.db'
 database_path = f'sqlite:///../{database_folder}/{database_name}'
 
+# WAL lets readers in while the translation machine writes. With WAL, synchronous=normal is still crash safe, it
+# just might lose the last transaction on a power cut. WAL only works for processes on the same machine, don't put
+# the DB on a network drive.
+sqlite_pragmas = {
+    'journal_mode': config('SQLITE_JOURNAL_MODE', default='wal'),
+    'synchronous': config('SQLITE_SYNCHRONOUS', default='normal'),
+    'cache_size': config('SQLITE_CACHE_SIZE', default=-64 * 1024, cast=int),  # Negative = KiB
+    'mmap_size': config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int),
+    'temp_store': 'memory',
+}
+
 # Gonna need one of these!
-sqlite_db = SqliteExtDatabase(database_path)
+sqlite_db = SqliteExtDatabase(database_path, pragmas=sqlite_pragmas)
 
 
 # Probably one of these too
@@ -29,6 +43,44 @@ class Translation(BaseModel):
     exclude_from_translation = IntegerField(default=False)
     exclusion_reason = TextField(default='')
     text_length = IntegerField(default=0)
+    # Worker mode. Whoever holds an unexpired lease on a row is the only one translating it.
+    lease_owner = TextField(default='')
+    lease_expires = FloatField(default=0)
+    lease_attempts = IntegerField(default=0)
+    # Been through the validators and the source file check. Re-runs only check strings they haven't seen.
+    validated = IntegerField(default=False)
+
+
+# Partial index for the translation work queue. It only holds the rows still waiting, so it stays small as the table
+# fills up with excluded and finished strings. SQLite doesn't allow parameters here, hence the raw SQL.
+Translation.add_index(Translation.index(Translation.extracted_text, name='translation_pending')
+                      .where(SQL("exclude_from_translation = 0 AND translation = ''")))
+
+
+class SourceFile(BaseModel):
+    path = TextField(unique=True)
+    # What the file looked like the last time we finished extracting it. Same fingerprint + codec = nothing to do.
+    fingerprint = TextField(default='')
+    codec = TextField(default='')
+    strings_fingerprint = TextField(default='')
+    string_count = IntegerField(default=0)
+
+
+class Occurrence(BaseModel):
+    # One row per match in a source file. Text is the stripped text, same as Translation.extracted_text.
+    source_file = ForeignKeyField(SourceFile, backref='occurrences', on_delete='CASCADE')
+    extracted_text = TextField(index=True)
+    offset = IntegerField()
+    encoded_length = IntegerField()
+    # Which codec decoded it. Matters when TEXT_CODEC lists more than one.
+    codec = TextField(default='')
+    # PE section it's in, for Windows exe/dll files.
+    section = TextField(default='')
+
+    class Meta:
+        indexes = (
+            (('source_file', 'offset'), True),
+        )
 
 
 def setup_db():
@@ -39,21 +91,234 @@ def setup_db():
     logger.info(f'Connecting database: {database_path}')
     sqlite_db.connect()
     logger.info(f'Connected.')
-    sqlite_db.create_tables([Translation])
+    sqlite_db.create_tables([Translation, SourceFile, Occurrence])
+    migrate_db()
     logger.info(f'Created tables.')
 
 
+def migrate_db():
+    # create_tables won't touch a table that already exists. Add any columns that came along after it was created.
+    for model in [Translation, SourceFile, Occurrence]:
+        table_name = model._meta.table_name
+        existing_columns = {column.name for column in sqlite_db.get_columns(table_name)}
+        missing_fields = [field for field in model._meta.sorted_fields if field.column_name not in existing_columns]
+        if missing_fields:
+            logger.info(f'Adding columns to {table_name}: {[field.column_name for field in missing_fields]}')
+            migrator = SqliteMigrator(sqlite_db)
+            migrate(*[migrator.add_column(table_name, field.column_name, field) for field in missing_fields])
+
+
 def get_untranslated_items(count: int) -> list:
     # -1 = Return all rows
     return Translation.select().where(Translation.exclude_from_translation == 0,
                                       Translation.translation == '').limit(count)
 
 
+def get_untranslated_items_in(texts: list) -> list:
+    """
+    Of the given strings, fetch the rows that still need translating.
+    """
+    items = []
+    # One param per text. Stay well under SQLite's variable limit.
+    for batch in chunked(texts, 500):
+        items.extend(Translation.select().where(Translation.extracted_text.in_(batch),
+                                                Translation.exclude_from_translation == 0,
+                                                Translation.translation == ''))
+    return items
+
+
 def get_untranslated_items_count() -> int:
     return Translation.select().where(Translation.exclude_from_translation == 0,
                                       Translation.translation == '').count()
 
 
+def get_translated_items() -> list:
+    """
+    :return: (extracted_text, translation) tuples for everything we've translated so far.
+    """
+    return list(Translation.select(Translation.extracted_text, Translation.translation)
+                .where(Translation.exclude_from_translation == 0, Translation.translation != '')
+                .tuples())
+
+
+def get_exportable_items(source_file: SourceFile = None):
+    """
+    Everything we translated and didn't exclude. Optionally only the strings found in a single file, the last time it
+    was extracted.
+    """
+    query = Translation.select().where(Translation.exclude_from_translation == 0, Translation.translation != '')
+    if source_file is not None:
+        query = query.where(Translation.extracted_text.in_(
+            Occurrence.select(Occurrence.extracted_text).where(Occurrence.source_file == source_file)))
+    return query
+
+
+def lease_untranslated_items(owner: str, count: int, lease_seconds: float, max_attempts: int) -> list:
+    """
+    Atomically claim up to count untranslated rows for a worker. Rows under someone else's unexpired lease are
+    skipped, expired leases (crashed workers) are fair game. Rows that have been leased max_attempts times are left
+    alone.
+    """
+    now = time.time()
+    lease_expires = now + lease_seconds
+    table_name = Translation._meta.table_name
+    # IMMEDIATE takes the write lock up front, so two workers can't pick the same rows.
+    with sqlite_db.atomic('IMMEDIATE'):
+        sqlite_db.execute_sql(
+            f'UPDATE "{table_name}" SET lease_owner = ?, lease_expires = ?, lease_attempts = lease_attempts + 1 '
+            f'WHERE extracted_text IN (SELECT extracted_text FROM "{table_name}" '
+            f"WHERE exclude_from_translation = 0 AND translation = '' AND lease_expires < ? AND lease_attempts < ? "
+            f'LIMIT ?)',
+            (owner, lease_expires, now, max_attempts, count))
+        return list(Translation.select().where(Translation.exclude_from_translation == 0,
+                                               Translation.translation == '',
+                                               Translation.lease_owner == owner,
+                                               Translation.lease_expires == lease_expires))
+
+
+def get_leased_items_count(max_attempts: int) -> int:
+    """
+    How many untranslated rows are still out on an unexpired lease, or could be leased again later.
+    """
+    return Translation.select().where(Translation.exclude_from_translation == 0,
+                                      Translation.translation == '',
+                                      Translation.lease_attempts < max_attempts,
+                                      Translation.lease_expires >= time.time()).count()
+
+
 def exclude_string(phrase: str, exclusion_reason: str):
     Translation.update(exclude_from_translation=True, exclusion_reason=exclusion_reason).where(
         Translation.extracted_text == phrase).execute()
+
+
+def exclude_strings_in_bulk(exclusions: list):
+    """
+    Exclude a pile of strings with one statement.
+    :param exclusions: (exclusion_reason, phrase) pairs
+    """
+    table_name = Translation._meta.table_name
+    with sqlite_db.atomic():
+        sqlite_db.cursor().executemany(
+            f'UPDATE "{table_name}" SET exclude_from_translation = 1, exclusion_reason = ? WHERE extracted_text = ?',
+            exclusions)
+
+
+def update_translations_in_bulk(translations: list):
+    """
+    Save a pile of translations with one statement.
+    :param translations: (translation, extracted_text) pairs
+    """
+    table_name = Translation._meta.table_name
+    with sqlite_db.atomic():
+        sqlite_db.cursor().executemany(f'UPDATE "{table_name}" SET translation = ? WHERE extracted_text = ?',
+                                       translations)
+
+
+def insert_extracted_texts_in_bulk(texts: list) -> int:
+    """
+    Insert new strings, skipping any we already have. Goes straight to executemany, peewee building the SQL for every
+    row costs far more than SQLite inserting it.
+    :return: Number of strings that were actually new.
+    """
+    # Peewee fills in defaults on the Python side, so every column needs a value here.
+    fields = Translation._meta.sorted_fields
+    columns = ', '.join(f'"{field.column_name}"' for field in fields)
+    placeholders = ', '.join('?' for _ in fields)
+    defaults = [field.default() if callable(field.default) else field.default for field in fields]
+    # No fields.index() here. Field == Field builds a peewee expression, which is always truthy.
+    field_names = [field.name for field in fields]
+    text_index = field_names.index('extracted_text')
+    length_index = field_names.index('text_length')
+
+    rows = []
+    for text in texts:
+        row = list(defaults)
+        row[text_index] = text
+        row[length_index] = len(text)
+        rows.append(row)
+
+    with sqlite_db.atomic():
+        cursor = sqlite_db.cursor()
+        cursor.executemany(f'INSERT OR IGNORE INTO "{Translation._meta.table_name}" ({columns}) VALUES ({placeholders})',
+                           rows)
+        return cursor.rowcount
+
+
+def get_source_file(path: str) -> SourceFile:
+    source_file, _ = SourceFile.get_or_create(path=os.path.abspath(path))
+    return source_file
+
+
+def insert_occurrences(source_file: SourceFile, occurrences: list):
+    """
+    Bulk insert string locations.
+    :param occurrences: (extracted_text, offset, encoded_length, codec, section) tuples
+    """
+    with sqlite_db.atomic():
+        # 6 params per row. Stay well under SQLite's variable limit.
+        for batch in chunked(occurrences, 150):
+            Occurrence.insert_many([(source_file.id, *occurrence) for occurrence in batch],
+                                   fields=[Occurrence.source_file, Occurrence.extracted_text, Occurrence.offset,
+                                           Occurrence.encoded_length, Occurrence.codec,
+                                           Occurrence.section]).on_conflict_ignore().execute()
+
+
+def get_occurring_texts(source_file: SourceFile) -> set:
+    """
+    :return: Every distinct string found in a file the last time it was extracted.
+    """
+    return {text for (text,) in Occurrence.select(Occurrence.extracted_text).where(Occurrence.source_file == source_file)
+            .distinct().tuples()}
+
+
+def get_unvalidated_texts() -> list:
+    return [text for (text,) in Translation.select(Translation.extracted_text)
+            .where(Translation.exclude_from_translation == 0, Translation.validated == 0)
+            .tuples()]
+
+
+def mark_all_validated():
+    return Translation.update(validated=True).where(Translation.validated == 0).execute()
+
+
+def mark_validated(texts: list):
+    with sqlite_db.atomic():
+        for batch in chunked(texts, 500):
+            Translation.update(validated=True).where(Translation.extracted_text.in_(batch)).execute()
+
+
+def reset_validated():
+    # Everything goes through the validators again. (e.g. the validators changed)
+    return Translation.update(validated=False).where(Translation.validated != 0).execute()
+
+
+def clear_occurrences(source_file: SourceFile):
+    Occurrence.delete().where(Occurrence.source_file == source_file).execute()
+
+
+def get_occurrences(text: str) -> list:
+    return list(Occurrence.select().where(Occurrence.extracted_text == text).order_by(Occurrence.offset))
+
+
+def get_occurrence_counts(source_file: SourceFile = None) -> dict:
+    """
+    :return: Dictionary of extracted text to the number of times it shows up. Optionally for a single file.
+    """
+    query = Occurrence.select(Occurrence.extracted_text, fn.COUNT(Occurrence.id))
+    if source_file is not None:
+        query = query.where(Occurrence.source_file == source_file)
+    return dict(query.group_by(Occurrence.extracted_text).tuples())
+
+
+def get_text_codecs(source_file: SourceFile = None) -> dict:
+    """
+    :return: Dictionary of extracted text to the codecs it was found in, sorted. Optionally for a single file.
+    """
+    query = (Occurrence.select(Occurrence.extracted_text, Occurrence.codec).distinct()
+             .where(Occurrence.codec != '').order_by(Occurrence.extracted_text, Occurrence.codec))
+    if source_file is not None:
+        query = query.where(Occurrence.source_file == source_file)
+    text_codecs = {}
+    for text, codec in query.tuples():
+        text_codecs.setdefault(text, []).append(codec)
+    return text_codecs
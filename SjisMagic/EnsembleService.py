@@ -0,0 +1,118 @@
+"""
+Ensemble translation. The same phrase goes to several brains at once, and a scorer picks the best answer. As soon as
+one answer is good enough, the calls still outstanding get cancelled, so we don't wait on the slowest brain.
+"""
+import asyncio
+import logging
+from collections import Counter
+from typing import Callable
+
+import unicodedata
+
+from utils import is_placeholder
+
+logger = logging.getLogger('ensemble')
+logger.setLevel(logging.INFO)
+
+stats = Counter()
+
+
+def score_translation(text: str, translation: str, other_translations: list) -> float:
+    """
+    Default scorer. Placeholders and empty answers are worth 0. Anything else starts at 1, gets 1 more if it fits in
+    the space the original takes up, and 1 more for every other brain that came up with the same thing.
+    :param other_translations: What the other brains answered, so far.
+    """
+    if not translation or is_placeholder(translation):
+        return 0
+
+    score = 1
+    if fits_length_budget(text, translation):
+        score += 1
+    score += sum(1 for other_translation in other_translations if translations_agree(translation, other_translation))
+    return score
+
+
+def fits_length_budget(text: str, translation: str) -> bool:
+    # The translation has to fit where the original lives in the binary.
+    try:
+        budget = len(text.encode('shift_jisx0213'))
+    except UnicodeEncodeError:
+        budget = len(text) * 2
+    return len(translation.encode('shift_jisx0213', errors='replace')) <= budget
+
+
+def translations_agree(translation: str, other_translation: str) -> bool:
+    # Same words. Case, width, spacing and punctuation don't count.
+    return simplify(translation) == simplify(other_translation)
+
+
+def simplify(translation: str) -> str:
+    translation = unicodedata.normalize('NFKC', translation).casefold()
+    return ''.join(char for char in translation if not unicodedata.category(char).startswith(('P', 'Z')))
+
+
+async def race(text: str, attempts: dict, scorer: Callable = score_translation, good_enough: float = 3):
+    """
+    Run every brain's attempt at once. Stop as soon as an answer scores good_enough, otherwise wait for all of them.
+    :param attempts: Dictionary of brain name to a coroutine that translates the text.
+    :param scorer: scorer(text, translation, other translations) -> score. Higher is better.
+    :param good_enough: Score that ends the race early. With the default scorer, 3 = fits, and another brain agrees.
+    :return: (brain name, translation, score) of the winner.
+    """
+    tasks = {asyncio.ensure_future(attempt): brain_name for brain_name, attempt in attempts.items()}
+    answers = {}
+    errors = []
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                    logger.debug(f'{tasks[task]} failed on "{text}": {task.exception()}')
+                    continue
+                answers[tasks[task]] = task.result()
+
+            winner = pick_winner(text, answers, scorer)
+            if winner is not None and winner[2] >= good_enough:
+                break
+    finally:
+        # Anything still queued never gets sent. Calls already out finish in the background, we ignore the answer.
+        for task in pending:
+            task.cancel()
+        stats['cancelled'] += len(pending)
+        if pending:
+            stats['early_stops'] += 1
+
+    winner = pick_winner(text, answers, scorer)
+    if winner is None:
+        raise errors[0] if errors else Exception(f'No brain translated "{text}"')
+
+    stats[f'wins_{winner[0]}'] += 1
+    logger.debug(f'Ensemble picked {winner[0]} ({winner[2]}) for "{text}" out of {answers}')
+    return winner
+
+
+def pick_winner(text: str, answers: dict, scorer: Callable):
+    """
+    :return: (brain name, translation, score) with the best score, None if there aren't any answers yet. A placeholder
+    only wins if nobody came up with a real answer, whatever the scorer thinks of it.
+    """
+    winner = None
+    for brain_name, translation in answers.items():
+        other_translations = [other for other_name, other in answers.items() if other_name != brain_name]
+        score = scorer(text, translation, other_translations)
+        if winner is None or rank(translation, score) > rank(winner[1], winner[2]):
+            winner = (brain_name, translation, score)
+    return winner
+
+
+def rank(translation: str, score: float):
+    return bool(translation) and not is_placeholder(translation), score
+
+
+def log_stats():
+    wins = {stat[len('wins_'):]: count for stat, count in stats.items() if stat.startswith('wins_')}
+    logger.info(f"Ensemble: wins {wins}, stopped early {stats['early_stops']:,} times, cancelled "
+                f"{stats['cancelled']:,} calls.")
@@ -1,10 +1,16 @@
+import glob
 import logging
+import os
 
-from SjisMagic.DatabaseService import Translation
+from SjisMagic.DatabaseService import get_exportable_items, get_text_codecs
 
 logger = logging.getLogger('utils')
 logger.setLevel(logging.INFO)
 
+# popnhax matches the bytes in the binary, so each string gets written in the codec it was found in. This is for the
+# strings we don't know that for.
+default_dict_codec = 'shift_jisx0213'
+
 
 def check_file_contains_bytes(search_bytes, source_file_path):
     # Make sure it all exits in the source file
@@ -17,16 +23,78 @@ def check_file_contains_bytes(search_bytes, source_file_path):
         return True
 
 
-def write_popnhax_dict(output_file_path):
+def write_popnhax_dict(output_file_path, source_file=None) -> bool:
+    """
+    Export the dictionary. If nothing changed since the last export, the file is left alone.
+    :param source_file: Only export strings found in this file. None = everything.
+    :return: True if the file was (re)written.
+    """
     # Find everything we translated and didn't exclude.
-    list_of_items = Translation.select().where(Translation.exclude_from_translation == 0,
-                                               Translation.translation != '')
+    list_of_items = get_exportable_items(source_file)
+    text_codecs = get_text_codecs(source_file)
 
     logger.info(f'Exporting {list_of_items.count()} dictionary items.')
-    outputfile = open(output_file_path, "w", encoding='shift_jisx0213')
+    lines = []
     for trans in list_of_items:
-        line = f';{trans.extracted_text};{trans.translation}\n'
-        try:
-            outputfile.write(line)
-        except Exception as e:
-            logger.warning(f'Error writing dict. Error: {e}\nLine: {line}')
+        # Same line endings as a file opened in text mode
+        line = f';{trans.extracted_text};{trans.translation}{os.linesep}'
+        # A string found in more than one codec gets a line for each, unless the bytes come out the same.
+        encoded_lines = []
+        for codec in text_codecs.get(trans.extracted_text, [default_dict_codec]):
+            try:
+                encoded_lines.append(line.encode(codec))
+            except Exception as e:
+                logger.warning(f'Error writing dict. Error: {e}\nLine: {line}')
+        lines.extend(dict.fromkeys(encoded_lines))
+
+    previous_lines = read_popnhax_dict_lines(output_file_path)
+    if previous_lines == lines:
+        logger.info(f'{output_file_path} is already up to date.')
+        return False
+
+    if previous_lines is not None:
+        added_count = len(set(lines) - set(previous_lines))
+        removed_count = len(set(previous_lines) - set(lines))
+        logger.info(f'Updating {output_file_path}: {added_count:,} lines added, {removed_count:,} removed.')
+
+    with open(output_file_path, "wb") as outputfile:
+        outputfile.writelines(lines)
+    return True
+
+
+def read_popnhax_dict_lines(dict_file_path):
+    """
+    :return: The lines of an earlier export, as bytes. None if there isn't one we can read.
+    """
+    try:
+        with open(dict_file_path, 'rb') as dict_file:
+            return dict_file.readlines()
+    except OSError:
+        return None
+
+
+def find_input_files(input_pattern: str) -> list:
+    """
+    :param input_pattern: A directory (everything in it, recursively) or a glob. (e.g. working/*.dll)
+    :return: Sorted file paths.
+    """
+    if os.path.isdir(input_pattern):
+        input_pattern = os.path.join(input_pattern, '**', '*')
+    return sorted(path for path in glob.glob(input_pattern, recursive=True) if os.path.isfile(path))
+
+
+def get_dict_file_paths(input_file_paths: list, output_folder: str) -> dict:
+    """
+    One .dict per input, named after it. (popn22.dll -> popn22.dict) Inputs with the same name in different folders
+    get their folder name in front.
+    :return: Dictionary of input file path to output file path.
+    """
+    dict_file_paths = {}
+    for input_file_path in input_file_paths:
+        file_name = os.path.splitext(os.path.basename(input_file_path))[0]
+        dict_file_path = os.path.join(output_folder, f'{file_name}.dict')
+        if dict_file_path in dict_file_paths.values():
+            folder_name = os.path.basename(os.path.dirname(os.path.abspath(input_file_path)))
+            dict_file_path = os.path.join(output_folder, f'{folder_name}_{file_name}.dict')
+        dict_file_paths[input_file_path] = dict_file_path
+    return dict_file_paths
@@ -0,0 +1,189 @@
+"""
+Run metrics. Stage timers, per-provider request stats, and whatever else wants to be in the report. Everything ends up
+in a JSON report at the end of the run, so runs (and releases) can be compared.
+
+Stages can be profiled too. PROFILE_STAGES takes a comma separated list of stage names, or 'all'. PROFILER picks
+cprofile (default, writes .prof files for snakeviz/pstats) or pyinstrument (writes .html, if it's installed).
+"""
+import cProfile
+import json
+import logging
+import os
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from decouple import config
+
+logger = logging.getLogger('metrics')
+logger.setLevel(logging.INFO)
+
+report_path = config('RUN_REPORT_PATH', default='sjismagic-report.json')
+profile_stages = {stage_name.strip() for stage_name in config('PROFILE_STAGES', default='').split(',')
+                  if stage_name.strip()}
+profiler_name = config('PROFILER', default='cprofile')
+profile_folder = config('PROFILE_FOLDER', default='profiles')
+
+started_at = datetime.now()
+stages = defaultdict(lambda: {'seconds': 0.0, 'calls': 0})
+providers = defaultdict(lambda: {'requests': 0, 'retries': 0, 'failures': 0, 'tokens': 0, 'chars': 0,
+                                 'latencies': []})
+sections = {}
+_profilers = {}
+_profiling = False
+
+
+@contextmanager
+def stage(stage_name: str):
+    """
+    Time a stage. Stages that run more than once (e.g. once per chunk) add up.
+    """
+    global _profiling
+    # Profilers don't nest. A stage inside a profiled stage shows up in the outer one's profile.
+    profiler = None if _profiling else get_profiler(stage_name)
+    if profiler is not None:
+        _profiling = True
+        profiler.start()
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[stage_name]['seconds'] += time.perf_counter() - start_time
+        stages[stage_name]['calls'] += 1
+        if profiler is not None:
+            profiler.stop()
+            _profiling = False
+
+
+def record_request(provider: str, seconds: float, tokens: int, chars: int, outcome: str):
+    """
+    :param outcome: 'ok', 'retry' or 'failure'
+    """
+    provider_stats = providers[provider]
+    provider_stats['requests'] += 1
+    provider_stats['tokens'] += tokens
+    provider_stats['chars'] += chars
+    provider_stats['latencies'].append(seconds)
+    if outcome == 'retry':
+        provider_stats['retries'] += 1
+    elif outcome == 'failure':
+        provider_stats['failures'] += 1
+
+
+def add_section(section_name: str, data):
+    # Anything else worth keeping. Has to be JSON friendly.
+    sections[section_name] = data
+
+
+def percentile(sorted_values: list, percent: float) -> float:
+    # Nearest rank
+    if not sorted_values:
+        return 0
+    rank = max(1, round(percent / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize_latencies(latencies: list) -> dict:
+    sorted_latencies = sorted(latencies)
+    return {
+        'count': len(sorted_latencies),
+        'p50': percentile(sorted_latencies, 50) * 1000,
+        'p95': percentile(sorted_latencies, 95) * 1000,
+        'p99': percentile(sorted_latencies, 99) * 1000,
+        'mean': sum(sorted_latencies) / len(sorted_latencies) * 1000 if sorted_latencies else 0,
+        'max': sorted_latencies[-1] * 1000 if sorted_latencies else 0,
+    }
+
+
+def build_report() -> dict:
+    finished_at = datetime.now()
+    return {
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'finished_at': finished_at.isoformat(timespec='seconds'),
+        'total_seconds': (finished_at - started_at).total_seconds(),
+        'stages': dict(stages),
+        'providers': {provider: {**{key: value for key, value in provider_stats.items() if key != 'latencies'},
+                                 'latency_ms': summarize_latencies(provider_stats['latencies'])}
+                      for provider, provider_stats in providers.items()},
+        **sections,
+    }
+
+
+def write_report(output_path: str = None):
+    output_path = output_path or report_path
+    report = build_report()
+    with open(output_path, 'w', encoding='utf-8') as report_file:
+        json.dump(report, report_file, indent=2, ensure_ascii=False)
+
+    for stage_name, stage_stats in report['stages'].items():
+        logger.info(f"{stage_name}: {stage_stats['seconds']:,.2f} seconds.")
+    for provider, provider_stats in report['providers'].items():
+        latency = provider_stats['latency_ms']
+        logger.info(f"{provider}: {provider_stats['requests']:,} requests. p50 {latency['p50']:,.0f}ms "
+                    f"p95 {latency['p95']:,.0f}ms p99 {latency['p99']:,.0f}ms")
+    logger.info(f'Wrote run report: {output_path}')
+
+    write_profiles()
+
+
+# region Profiling
+class CProfileStage:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, output_path: str):
+        self.profile.dump_stats(f'{output_path}.prof')
+
+
+class PyinstrumentStage:
+    def __init__(self):
+        from pyinstrument import Profiler
+        self.profiler = Profiler(async_mode='enabled')
+
+    def start(self):
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+
+    def write(self, output_path: str):
+        with open(f'{output_path}.html', 'w', encoding='utf-8') as profile_file:
+            profile_file.write(self.profiler.output_html())
+
+
+def get_profiler(stage_name: str):
+    """
+    :return: The profiler for this stage, None if we're not profiling it.
+    """
+    if not profile_stages or ('all' not in profile_stages and stage_name not in profile_stages):
+        return None
+
+    if stage_name not in _profilers:
+        profiler = None
+        if profiler_name == 'pyinstrument':
+            try:
+                profiler = PyinstrumentStage()
+            except ImportError:
+                logger.warning('pyinstrument is not installed. Using cProfile.')
+        _profilers[stage_name] = profiler or CProfileStage()
+    return _profilers[stage_name]
+
+
+def write_profiles():
+    if not _profilers:
+        return
+
+    os.makedirs(profile_folder, exist_ok=True)
+    for stage_name, profiler in _profilers.items():
+        file_name = re.sub(r'[^\w-]+', '_', stage_name).strip('_')
+        profiler.write(os.path.join(profile_folder, file_name))
+    logger.info(f'Wrote {len(_profilers):,} stage profiles to {profile_folder}')
+# endregion
@@ -1,18 +1,35 @@
 import json
 import logging
-import ollama
+
+from SjisMagic.ProviderRegistry import shared_client
+from utils import parse_response_to_dic, build_batch_prompt
 
 logger = logging.getLogger('ollama')
 logger.setLevel(logging.INFO)
 
+MODEL = "llama3:instruct."
+SYSTEM_PROMPT = ("Translate Japanese text to English. Do not respond conversationally. If it can't"
+                 "be translated, respond 'XXX'. Try to provide a response with less than {length} "
+                 "characters.")
+BATCH_SYSTEM_PROMPT = ("Translate Japanese text from the rhythm game Pop'n Music to English. Do not respond "
+                       "conversationally. If a phrase can't be translated, translate it as 'XXX'. Keep translations "
+                       "shorter than the original phrase. Respond with JSON in the following format: "
+                       '{"translations": [{"original": "", "translation": ""}]}')
+
+
+@shared_client
+def get_client():
+    # Picks up OLLAMA_HOST, same as the module level functions.
+    import ollama
+    return ollama.Client()
+
 
-def translate(text) -> str:
+def translate(text, context: str = '') -> str:
     length = len(text)
-    response = ollama.generate(model="llama3:instruct.",
-                               system="Translate Japanese text to English. Do not respond conversationally. If it can't"
-                                      f"be translated, respond 'XXX'. Try to provide a response with less than {length} "
-                                      f"characters.",
-                               prompt=f"{text}")
+    # Context goes in the system prompt. In the prompt, the model tends to translate it too.
+    response = get_client().generate(model=MODEL,
+                                     system=SYSTEM_PROMPT.format(length=length) + context,
+                                     prompt=f"{text}")
 
     logger.debug(f'Response content: {response}')
 
@@ -21,3 +38,17 @@ def translate(text) -> str:
     logger.debug(f"Translation: {translation}")
 
     return translation
+
+
+def translate_batch(texts: list) -> dict:
+    """
+    Translate several phrases with a single request.
+    :return: Dictionary of original phrase to translation. Phrases the model skipped won't be in it.
+    """
+    response = get_client().generate(model=MODEL,
+                                     system=BATCH_SYSTEM_PROMPT,
+                                     prompt=build_batch_prompt(texts),
+                                     format='json')
+
+    logger.debug(f'Response content: {response}')
+    return parse_response_to_dic(response['response'])
@@ -2,37 +2,49 @@ import json
 import logging
 import os
 
-import openai
+from SjisMagic.ProviderRegistry import shared_client
+from utils import parse_response_to_dic, build_batch_prompt
 
 logger = logging.getLogger('openAI')
 logger.setLevel(logging.INFO)
 
+MODEL = "gpt-3.5-turbo"
+SYSTEM_PROMPT = ("Your job is to translate Japanese phrases from the rhythm game Pop'n Music into English. "
+                 "\nProcess phrases using the following "
+                 "steps:\n\n- If the Japanese is nonsensical, translate it as 'NNN'.\n- If the phrase is "
+                 "meant to be parsed by a program, translate it as 'PPP'.\n- Otherwise translate it to "
+                 "English. \n- Your translations should be as short as possible. Paraphrasing, "
+                 "abbreviation, using incorrect spelling, and symbols are all ok. \n- Your translation "
+                 "should not be longer than the Japanese phrase. Spaces and symbols count towards the "
+                 "length.\n\nPlease return the translations as JSON in the following format:\n{ \n"
+                 "translations:[\n    original:\"\"\n    translation:\"\"\n  ]\n}"
+                 )
+# The JSON format we ask for already covers several phrases.
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT
 
-def translate(text) -> str:
-    length = len(text)
-    client = openai.OpenAI(
+
+@shared_client
+def get_client():
+    # The SDK takes a while to import. Only pay for it if we're actually using ChatGPT.
+    import openai
+    return openai.OpenAI(
         # This is the default and can be omitted
         api_key=os.environ.get("OPENAI_API_KEY"),
     )
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
+
+
+def translate(text, context: str = '') -> str:
+    length = len(text)
+    response = get_client().chat.completions.create(
+        model=MODEL,
         messages=[
             {
                 "role": "system",
-                "content": ("Your job is to translate Japanese phrases from the rhythm game Pop'n Music into English. "
-                            "\nProcess phrases using the following "
-                            "steps:\n\n- If the Japanese is nonsensical, translate it as 'NNN'.\n- If the phrase is "
-                            "meant to be parsed by a program, translate it as 'PPP'.\n- Otherwise translate it to "
-                            "English. \n- Your translations should be as short as possible. Paraphrasing, "
-                            "abbreviation, using incorrect spelling, and symbols are all ok. \n- Your translation "
-                            "should not be longer than the Japanese phrase. Spaces and symbols count towards the "
-                            "length.\n\nPlease return the translations as JSON in the following format:\n{ \n"
-                            "translations:[\n    original:\"\"\n    translation:\"\"\n  ]\n}"
-                            )
+                "content": SYSTEM_PROMPT
             },
             {
                 "role": "user",
-                "content": f'Translate "{text}". Do not use more than {len(text)} characters.'
+                "content": f'Translate "{text}". Do not use more than {len(text)} characters.{context}'
             }
 
         ],
@@ -47,3 +59,28 @@ def translate(text) -> str:
     logger.debug(f"Parsed JSON: {translated_string}")
 
     return translated_string
+
+
+def translate_batch(texts: list) -> dict:
+    """
+    Translate several phrases with a single request.
+    :return: Dictionary of original phrase to translation. Phrases the model skipped won't be in it.
+    """
+    response = get_client().chat.completions.create(
+        model=MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": build_batch_prompt(texts)
+            }
+        ],
+        response_format={"type": "json_object"}
+    )
+
+    response_content = response.choices[0].message.content
+    logger.debug(f'Response content: {response_content}')
+    return parse_response_to_dic(response_content)
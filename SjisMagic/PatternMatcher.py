@@ -0,0 +1,93 @@
+"""
+Aho-Corasick multi-pattern matching over bytes. Finds every occurrence of every pattern in one pass over the data,
+instead of one pass per pattern.
+"""
+import logging
+import re
+from collections import deque
+
+logger = logging.getLogger('patternmatcher')
+logger.setLevel(logging.INFO)
+
+
+def build_automaton(patterns: list):
+    """
+    Build the automaton for a list of byte strings.
+    :return: (goto, fail, output) tables. goto[state] maps byte -> next state, fail[state] is the fallback state on a
+    mismatch, output[state] lists the indexes of every pattern that ends at that state.
+    """
+    goto = [{}]
+    fail = [0]
+    output = [[]]
+
+    # Build the trie
+    for index, pattern in enumerate(patterns):
+        if not pattern:
+            continue
+        state = 0
+        for byte in pattern:
+            next_state = goto[state].get(byte)
+            if next_state is None:
+                next_state = len(goto)
+                goto.append({})
+                fail.append(0)
+                output.append([])
+                goto[state][byte] = next_state
+            state = next_state
+        output[state].append(index)
+
+    # Breadth first, so a state's fail state is always finished before we need it.
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for byte, next_state in goto[state].items():
+            queue.append(next_state)
+
+            fallback = fail[state]
+            while fallback and byte not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[next_state] = goto[fallback].get(byte, 0)
+
+            # Anything that ends at the fail state also ends here. (e.g. 'bc' inside 'abc')
+            if output[fail[next_state]]:
+                output[next_state] = output[next_state] + output[fail[next_state]]
+
+    logger.debug(f'Built automaton with {len(goto):,} states for {len(patterns):,} patterns.')
+    return goto, fail, output
+
+
+def count_occurrences(patterns: list, data) -> list:
+    """
+    Count how many times each pattern occurs in the data. Overlapping occurrences all count.
+    :param data: bytes, or anything that indexes like it. (mmap works)
+    :return: Counts, in the same order as patterns.
+    """
+    counts = [0] * len(patterns)
+    goto, fail, output = build_automaton(patterns)
+    if not goto[0]:
+        return counts
+
+    # Most of a binary doesn't start any pattern. While we're at the root, let the regex engine skip ahead to the
+    # next byte that does.
+    first_bytes = re.compile(b'[' + b''.join(re.escape(bytes([byte])) for byte in goto[0]) + b']')
+
+    state = 0
+    position = 0
+    data_length = len(data)
+    while position < data_length:
+        if state == 0:
+            match = first_bytes.search(data, position)
+            if match is None:
+                break
+            position = match.start()
+
+        byte = data[position]
+        while state and byte not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(byte, 0)
+
+        for index in output[state]:
+            counts[index] += 1
+        position += 1
+
+    return counts
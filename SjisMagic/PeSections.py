@@ -0,0 +1,62 @@
+"""
+Just enough of a PE (Windows exe/dll) parser to find the sections in the file. Strings live in the data sections
+(.rdata, .data), scanning code and resources for them only turns up junk.
+"""
+import logging
+import struct
+from collections import namedtuple
+
+logger = logging.getLogger('pesections')
+logger.setLevel(logging.INFO)
+
+# Where a section's data sits in the file. End is exclusive.
+Section = namedtuple('Section', ['name', 'start', 'end'])
+
+section_header_size = 40
+
+
+def read_sections(input_file_path: str) -> list:
+    """
+    :return: Sections that have data in the file, in file order. Empty if it's not a PE file.
+    """
+    with open(input_file_path, 'rb') as file:
+        file_size = file.seek(0, 2)
+        file.seek(0)
+        # DOS header. The PE header's offset is at 0x3C.
+        dos_header = file.read(64)
+        if len(dos_header) < 64 or dos_header[:2] != b'MZ':
+            return []
+        pe_offset, = struct.unpack_from('<I', dos_header, 0x3C)
+
+        # PE signature, then the COFF header.
+        file.seek(pe_offset)
+        pe_header = file.read(24)
+        if len(pe_header) < 24 or pe_header[:4] != b'PE\x00\x00':
+            return []
+        section_count, = struct.unpack_from('<H', pe_header, 6)
+        optional_header_size, = struct.unpack_from('<H', pe_header, 20)
+
+        # Section table comes right after the optional header.
+        file.seek(pe_offset + 24 + optional_header_size)
+        section_table = file.read(section_count * section_header_size)
+
+    sections = []
+    for index in range(len(section_table) // section_header_size):
+        name, raw_size, raw_offset = struct.unpack_from('<8s8xII', section_table, index * section_header_size)
+        # Uninitialized data (.bss) has nothing in the file.
+        start = min(raw_offset, file_size)
+        end = min(raw_offset + raw_size, file_size)
+        if end > start:
+            sections.append(Section(name.rstrip(b'\x00').decode('ascii', errors='replace'), start, end))
+    return sorted(sections, key=lambda section: section.start)
+
+
+def find_section(sections: list, offset: int) -> str:
+    """
+    :return: Name of the section the offset is in. Empty if it's not in one. (Headers, overlay...)
+    """
+    # There's only ever a handful of sections.
+    for section in sections:
+        if section.start <= offset < section.end:
+            return section.name
+    return ''
@@ -0,0 +1,62 @@
+"""
+Provider registry. Each brain's service module, and the SDK behind it, only gets imported the first time that brain
+is used. Ollama-only runs never load the OpenAI or Anthropic SDKs.
+"""
+import functools
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger('providers')
+logger.setLevel(logging.INFO)
+
+# Brain name -> service module. None = not supported yet.
+providers = {
+    'ChatGPT': 'SjisMagic.OpenAIService',
+    'Claude': 'SjisMagic.AnthropicService',
+    'Google': None,
+    'Ollama': 'SjisMagic.OllamaService',
+}
+_services = {}
+
+
+def get_provider(brain_name: str):
+    """
+    Fetch the service module for a brain, importing it the first time.
+    """
+    service = _services.get(brain_name)
+    if service is not None:
+        return service
+
+    if brain_name not in providers:
+        raise Exception(f'Unknown brain {brain_name}')
+    if providers[brain_name] is None:
+        raise NotImplementedError
+
+    start_time = time.perf_counter()
+    service = importlib.import_module(providers[brain_name])
+    logger.debug(f'Loaded {brain_name} in {(time.perf_counter() - start_time) * 1000:,.0f}ms.')
+    _services[brain_name] = service
+    return service
+
+
+def shared_client(create_client):
+    """
+    Decorator for a service's client factory. The client gets created once, on first use, and every call after that
+    gets the same one. SDK clients hold a pool of open HTTP connections, so only the first request pays for the
+    connection and TLS handshake. Safe to call from the brain's worker threads.
+    """
+    lock = threading.Lock()
+    client = None
+
+    @functools.wraps(create_client)
+    def get_client():
+        nonlocal client
+        if client is None:
+            with lock:
+                if client is None:
+                    client = create_client()
+        return client
+
+    return get_client
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from SjisMagic import Metrics
+
+logger = logging.getLogger('ratelimiter')
+logger.setLevel(logging.INFO)
+
+# Status codes worth another try. Everything else (bad key, bad request...) will fail the same way next time.
+transient_status_codes = {408, 409, 429, 500, 502, 503, 504, 529}
+
+DeadLetter = namedtuple('DeadLetter', ['provider', 'args', 'error'])
+
+
+class TokenBucket:
+    """
+    Classic token bucket. Refills continuously at the per-minute rate, and holds a few seconds' worth of burst.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def drain(self):
+        """
+        Empty the bucket. Used when the provider tells us to slow down, so everyone waits a bit.
+        """
+        self.refill()
+        self.tokens = 0
+
+    async def acquire(self, amount: float = 1):
+        if self.rate <= 0:
+            return
+
+        # Something bigger than the bucket would wait forever. Let it through once the bucket is full.
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self.refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= amount
+
+
+class ProviderScheduler:
+    """
+    Runs blocking provider calls on a bounded thread pool, inside the provider's request and token limits.
+    Transient failures are retried with jittered exponential backoff. Anything that still fails is kept as a dead
+    letter, and the error is raised to the caller.
+    """
+
+    def __init__(self, name: str, max_in_flight: int, requests_per_minute: int = 0, tokens_per_minute: int = 0,
+                 max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=f'brain-{name.lower()}')
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.dead_letters = []
+        self.stats = defaultdict(int)
+
+        logger.info(f'{name}: {max_in_flight} in flight, {requests_per_minute or "unlimited"} requests/min, '
+                    f'{tokens_per_minute or "unlimited"} tokens/min.')
+
+    async def run(self, func: Callable, *args, tokens: int = 1, chars: int = 0):
+        """
+        :param tokens: Estimated tokens, for the token budget.
+        :param chars: Characters sent, for the run report.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(tokens)
+            self.stats['requests'] += 1
+            # Timed on the worker thread, so waiting for a free thread doesn't count as provider latency.
+            timing = []
+            try:
+                result = await loop.run_in_executor(self.executor, call_timed, func, args, timing)
+                Metrics.record_request(self.name, sum(timing), tokens, chars, 'ok')
+                return result
+            except Exception as e:
+                if not is_transient_error(e) or attempt == self.max_retries:
+                    Metrics.record_request(self.name, sum(timing), tokens, chars, 'failure')
+                    self.stats['failures'] += 1
+                    self.dead_letters.append(DeadLetter(self.name, args, e))
+                    raise
+
+                Metrics.record_request(self.name, sum(timing), tokens, chars, 'retry')
+
+                if get_status_code(e) == 429:
+                    # Everyone's going to hit this. Empty the buckets so the other tasks wait too.
+                    self.request_bucket.drain()
+                    self.token_bucket.drain()
+
+                delay = get_retry_after(e) or self.backoff_delay(attempt)
+                self.stats['retries'] += 1
+                logger.info(f'{self.name}: {type(e).__name__} on attempt {attempt + 1}. Retrying in {delay:.1f}s.')
+                await asyncio.sleep(delay)
+
+    def backoff_delay(self, attempt: int) -> float:
+        # Full jitter. Keeps a pile of failed tasks from all coming back at the same moment.
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def log_dead_letters(self):
+        logger.info(f"{self.name}: {self.stats['requests']:,} requests, {self.stats['retries']:,} retries, "
+                    f"{self.stats['failures']:,} failures.")
+        for dead_letter in self.dead_letters:
+            logger.warning(f'{self.name}: Gave up on {dead_letter.args}. {type(dead_letter.error).__name__}: '
+                           f'{dead_letter.error}')
+
+
+def call_timed(func: Callable, args: tuple, timing: list):
+    start_time = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        timing.append(time.perf_counter() - start_time)
+
+
+def get_status_code(error: Exception):
+    # The OpenAI, Anthropic and Ollama SDKs all hang the HTTP status on the exception.
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status_code
+
+
+def get_retry_after(error: Exception):
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient_error(error: Exception) -> bool:
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code in transient_status_codes
+
+    # SDK connection/timeout errors don't carry a status code.
+    error_name = type(error).__name__
+    return 'Timeout' in error_name or 'Connection' in error_name
+
+
+def estimate_tokens(*texts: str) -> int:
+    # Rough, but close enough for budgeting. Japanese runs about a token per character, English about four
+    # characters per token. UTF-8 length over three lands between the two.
+    return sum(len(text.encode('utf-8')) // 3 + 1 for text in texts)
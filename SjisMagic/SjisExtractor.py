@@ -3,34 +3,152 @@ Thanks to CrazyRedMachine for the original version of this little gem.
 I owe this fella way too many beers at this point.
 -FuckwilderTuesday
 """
+import hashlib
+import mmap
+import os
 import re
 import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
+from decouple import config
+
+from SjisMagic import PeSections
 from SjisMagic.DatabaseService import *
 from utils import announce_status
 
 logger = logging.getLogger('extraction')
 logger.setLevel(logging.INFO)
 
+# Big files get split into chunks, scanned in a process pool. Each chunk also scans a little way into its neighbours,
+# so strings that cross a boundary aren't lost. Strings longer than the overlap could still be cut, there aren't any.
+extract_workers = config('EXTRACT_WORKERS', default=os.cpu_count() or 1, cast=int)
+extract_chunk_size = config('EXTRACT_CHUNK_SIZE', default=8 * 1024 * 1024, cast=int)
+extract_chunk_overlap = 64 * 1024
+
+# Windows exe/dll files can get only their data sections scanned. Code, relocations and resources are nothing but false
+# positives. Files that aren't PE files get scanned whole either way.
+pe_sections_only = config('PE_SECTIONS_ONLY', default=False, cast=bool)
+pe_sections = [section_name.strip() for section_name in config('PE_SECTIONS', default='.rdata,.data').split(',')
+               if section_name.strip()]
+
+# Rows per insert transaction. Also how much we lose to a single bad row.
+upsert_batch_size = 10_000
 
-def extract_strings(input_file_path: str, encoding: str):
+
+def extract_strings(input_file_path: str, encoding: str, force=False) -> dict:
     """
     Extract shift-jis strings from a file. Due to the nature of the encoding, shift-jis can't be identified with 100%
     precision. Expect to get some false positives.
     Output is de-duped.
 
-    :param encoding: sjis or shift_jisx0213
+    :param encoding: sjis, cp932 or shift_jisx0213. Or several, comma separated, if you're not sure what the file uses.
     :param input_file_path: Source file
     found in source file. Semicolon delimited.
+    :param force: Extract even if the file hasn't changed since we last did.
+    :return: Dictionary of 'New', 'Removed' and 'Unchanged' string counts, compared to the last extraction.
     """
 
     announce_status("Extracting strings")
+    source_file = get_source_file(input_file_path)
+    fingerprint = fingerprint_file(input_file_path)
+    if not force and source_file.fingerprint == fingerprint and source_file.codec == get_extraction_codec(encoding):
+        logger.info(f"{input_file_path} hasn't changed since it was last extracted. Skipping.")
+        return {'New': 0, 'Removed': 0, 'Unchanged': source_file.string_count}
+
+    return extract_strings_with_codec(input_file_path, encoding, fingerprint)
+
+
+def is_extracted(input_file_path: str, encoding: str) -> bool:
+    """
+    Has this exact file already been extracted with this codec?
+    """
+    source_file = get_source_file(input_file_path)
+    return (source_file.codec == get_extraction_codec(encoding) and
+            source_file.fingerprint == fingerprint_file(input_file_path))
+
+
+def fingerprint_file(input_file_path: str) -> str:
+    """
+    :return: Size and SHA-256 of the file. Reads it in blocks, so big files don't end up in memory.
+    """
+    file_hash = hashlib.sha256()
+    with open(input_file_path, 'rb') as file:
+        while block := file.read(1024 * 1024):
+            file_hash.update(block)
+    return f'{os.path.getsize(input_file_path)}:{file_hash.hexdigest()}'
+
+
+def fingerprint_strings(texts) -> str:
+    # Sorted, so the fingerprint doesn't care what order we found things in.
+    strings_hash = hashlib.sha256()
+    for text in sorted(texts):
+        strings_hash.update(text.encode('utf-8') + b'\x00')
+    return strings_hash.hexdigest()
+
+
+def compare_string_sets(previous_texts: set, current_texts: set) -> dict:
+    summary = {
+        'New': len(current_texts - previous_texts),
+        'Removed': len(previous_texts - current_texts),
+        'Unchanged': len(current_texts & previous_texts),
+    }
+    logger.info(f"Compared to last extraction: {summary['New']:,} new, {summary['Removed']:,} removed, "
+                f"{summary['Unchanged']:,} unchanged strings.")
+    return summary
+
+
+def record_extraction(source_file: SourceFile, fingerprint: str, encoding: str, texts: set):
+    """
+    Remember what we extracted, so the next run can tell if anything changed. Only call this once everything from the
+    file is safely in the DB.
+    """
+    strings_fingerprint = fingerprint_strings(texts)
+    if source_file.strings_fingerprint == strings_fingerprint:
+        logger.info('The file changed, but the strings in it are the same as last time.')
 
+    source_file.fingerprint = fingerprint
+    source_file.codec = get_extraction_codec(encoding)
+    source_file.strings_fingerprint = strings_fingerprint
+    source_file.string_count = len(texts)
+    source_file.save()
+
+
+def get_extraction_codec(encoding: str) -> str:
+    """
+    What SourceFile.codec records. The codec, plus the sections if we only scan some. Changing either re-extracts.
+    """
+    return f"{encoding}@{','.join(pe_sections)}" if pe_sections_only else encoding
+
+
+def get_codecs(encoding: str) -> list:
+    """
+    TEXT_CODEC can name several codecs, comma separated. (e.g. shift_jisx0213,cp932,sjis) The file still only gets
+    scanned once. Each string is decoded with the first codec listed that can.
+    :return: The codecs, in order of preference.
+    """
+    codecs = list(dict.fromkeys(codec.strip() for codec in encoding.split(',') if codec.strip()))
+    if not codecs:
+        raise Exception('Invalid encoding.')
+    return codecs
+
+
+def get_codecs_regex(codecs: list) -> bytes:
+    # Every codec's pattern stops at the first null, so whichever one matches at a spot, the match is the same bytes.
+    # (sjis and cp932 share a pattern. No need to try it twice.)
+    codec_regexes = list(dict.fromkeys(get_codec_regex(codec) for codec in codecs))
+    if len(codec_regexes) == 1:
+        return codec_regexes[0]
+    return b'|'.join(b'(?:' + codec_regex + b')' for codec_regex in codec_regexes)
+
+
+def get_codec_regex(encoding: str) -> bytes:
     if encoding == 'sjis':
-        codec_regex = b'[\x81-\x9f\xe0-\xef][\x40-\x7e\x80-\xfc]+'
+        codec_regex = b'[\x81-\x9f\xe0-\xef][\x40-\x7e\x80-\xfc]+\x00'
     elif encoding == 'shift_jisx0213':
-        codec_regex = (b'(?:[\x87-\x9f\xe0-\xef][\x40-\x7e\x80-\xfc]+|[\x81-\x84][\x40-\x7e\x80-\xfc]|[\xed-\xee]['
+        # The first trail run is possessive (++). Backtracking into it can't produce a different match, and without
+        # it a long run of high bytes that doesn't end in a null takes exponential time.
+        codec_regex = (b'(?:[\x87-\x9f\xe0-\xef][\x40-\x7e\x80-\xfc]++|[\x81-\x84][\x40-\x7e\x80-\xfc]|[\xed-\xee]['
                        b'\x40-\x7e\x80-\xfc]|[\xfa-\xfc][\x40-\x7e\x80-\xfc])+\x00')
     elif encoding == 'cp932':
         codec_regex = b'[\x81-\x9f\xe0-\xef][\x40-\x7e\x80-\xfc]+\x00'
@@ -38,40 +156,213 @@ def extract_strings(input_file_path: str, encoding: str):
     else:
         raise Exception('Invalid encoding.')
 
-    extract_strings_with_codec(input_file_path, codec_regex, encoding)
+    return codec_regex
 
 
-def extract_strings_with_codec(input_file_path: str, codec_regex: bytes, encoding: str):
-    logger.info(f"Extracting from: {input_file_path}")
-    with open(input_file_path, 'rb') as file:
-        binary_data = file.read()
+def extract_strings_with_codec(input_file_path: str, encoding: str, fingerprint: str = None) -> dict:
+    fingerprints = {input_file_path: fingerprint or fingerprint_file(input_file_path)}
+    return extract_files_with_codec(fingerprints, encoding)[input_file_path]
 
-    logger.debug(f"Read {len(binary_data):,} bytes from {input_file_path}")
 
-    extracted_strings = set()
-    collected_errors = defaultdict(int)
-    # Regular expression to match Shift JIS X 0213 encoded strings
-    pattern = re.compile(codec_regex)
+def extract_strings_from_files(input_file_paths: list, encoding: str, force=False) -> dict:
+    """
+    Batch mode. Extract every file that changed since last time, all at once. Chunks from all the files share one
+    process pool, and the strings go into the DB once, however many files they show up in.
+    :param force: Extract even the files that haven't changed.
+    :return: Dictionary of file path to its 'New', 'Removed' and 'Unchanged' string counts.
+    """
+    announce_status(f"Extracting strings from {len(input_file_paths):,} files")
+    summaries = {}
+    changed_fingerprints = {}
+    for input_file_path in input_file_paths:
+        source_file = get_source_file(input_file_path)
+        fingerprint = fingerprint_file(input_file_path)
+        if not force and source_file.fingerprint == fingerprint and source_file.codec == get_extraction_codec(encoding):
+            logger.info(f"{input_file_path} hasn't changed since it was last extracted. Skipping.")
+            summaries[input_file_path] = {'New': 0, 'Removed': 0, 'Unchanged': source_file.string_count}
+        else:
+            changed_fingerprints[input_file_path] = fingerprint
 
-    matches = pattern.finditer(binary_data)
-    for match in matches:
-        byte_sequence = match.group()[:-1]  # Strip the null byte
-        try:
-            decoded_string = byte_sequence.decode('shift_jisx0213')
-            extracted_strings.add(decoded_string)
-        except UnicodeDecodeError:
-            collected_errors["DecodeError"] += 1
-        except Exception as e:
-            collected_errors[type(e).__name__] += 1
-            logger.debug(f"Bytes: {match}")
-            logger.debug(f"Issue: {e}")
+    if changed_fingerprints:
+        summaries.update(extract_files_with_codec(changed_fingerprints, encoding))
+    return summaries
+
+
+def extract_files_with_codec(fingerprints: dict, encoding: str) -> dict:
+    """
+    :param fingerprints: Dictionary of file path to its fingerprint.
+    :param encoding: One codec, or several comma separated.
+    :return: Dictionary of file path to its 'New', 'Removed' and 'Unchanged' string counts.
+    """
+    input_file_paths = list(fingerprints)
+    # Every chunk of every file, as (file path, chunk_start, chunk_end, region, sections)
+    jobs = []
+    for input_file_path in input_file_paths:
+        logger.info(f"Extracting from: {input_file_path}")
+        jobs.extend((input_file_path, *scan_job) for scan_job in get_scan_jobs(input_file_path))
+
+    start_time = time.time()
+    if extract_workers <= 1 or len(jobs) <= 1:
+        chunk_results = [scan_chunk(input_file_path, encoding, *scan_job) for input_file_path, *scan_job in jobs]
+    else:
+        logger.info(f"Scanning {len(jobs):,} chunks with {extract_workers} workers.")
+        with ProcessPoolExecutor(max_workers=extract_workers) as executor:
+            chunk_results = list(executor.map(scan_chunk, [job[0] for job in jobs], [encoding] * len(jobs),
+                                              *[[job[column] for job in jobs] for column in range(1, 5)]))
+    logger.info(f"Scanned {len(input_file_paths):,} files in {time.time() - start_time:,.2f} seconds.")
+
+    # Record where everything lives. Re-extracting a file replaces what we knew about it.
+    source_files = {}
+    previous_texts = {}
+    for input_file_path in input_file_paths:
+        source_files[input_file_path] = get_source_file(input_file_path)
+        previous_texts[input_file_path] = get_occurring_texts(source_files[input_file_path])
+        clear_occurrences(source_files[input_file_path])
+
+    file_strings = defaultdict(set)
+    occurrence_counts = defaultdict(int)
+    collected_errors = defaultdict(int)
+    codec_counts = defaultdict(int)
+    section_counts = defaultdict(int)
+    for (input_file_path, *_), (chunk_strings, chunk_occurrences, chunk_errors) in zip(jobs, chunk_results):
+        file_strings[input_file_path].update(chunk_strings)
+        insert_occurrences(source_files[input_file_path], chunk_occurrences)
+        occurrence_counts[input_file_path] += len(chunk_occurrences)
+        for error, count in chunk_errors.items():
+            collected_errors[error] += count
+        for _, _, _, codec, section in chunk_occurrences:
+            codec_counts[codec] += 1
+            section_counts[section] += 1
 
     for error in collected_errors.keys():
         logger.warning(f"{error}: {collected_errors[error]:,}")
+    if len(get_codecs(encoding)) > 1:
+        logger.info(f"Occurrences by codec: "
+                    f"{', '.join(f'{codec}: {count:,}' for codec, count in codec_counts.items())}")
+    if any(section_counts):
+        logger.info(f"Occurrences by section: "
+                    f"{', '.join(f'{section or None}: {count:,}' for section, count in section_counts.items())}")
 
-    logger.info(f"Unique strings: {len(extracted_strings):,}")
+    extracted_strings = set()
+    for input_file_path in input_file_paths:
+        logger.info(f"{input_file_path}: Unique strings: {len(file_strings[input_file_path]):,} "
+                    f"Occurrences: {occurrence_counts[input_file_path]:,}")
+        extracted_strings.update(file_strings[input_file_path])
     upsert_extracted_texts(extracted_strings)
 
+    summaries = {}
+    for input_file_path in input_file_paths:
+        current_texts = {text.strip() for text in file_strings[input_file_path]} - {''}
+        summaries[input_file_path] = compare_string_sets(previous_texts[input_file_path], current_texts)
+        record_extraction(source_files[input_file_path], fingerprints[input_file_path], encoding, current_texts)
+    return summaries
+
+
+def get_chunks(size: int, start: int = 0) -> list:
+    """
+    :return: (chunk_start, chunk_end) pairs covering size bytes from start.
+    """
+    return [(chunk_start, min(chunk_start + extract_chunk_size, start + size))
+            for chunk_start in range(start, start + size, extract_chunk_size)]
+
+
+def get_scan_jobs(input_file_path: str) -> list:
+    """
+    Everything to pass scan_chunk for a file, after the path and codec. With PE_SECTIONS_ONLY that's the chunks of the
+    PE_SECTIONS sections, otherwise the chunks of the whole file.
+    :return: (chunk_start, chunk_end, region, sections) tuples
+    """
+    file_size = os.path.getsize(input_file_path)
+    sections = PeSections.read_sections(input_file_path)
+    if pe_sections_only:
+        selected_sections = [section for section in sections if section.name in pe_sections]
+        if selected_sections:
+            scan_size = sum(section.end - section.start for section in selected_sections)
+            logger.info(f"Scanning {', '.join(section.name for section in selected_sections)}: {scan_size:,} of "
+                        f"{file_size:,} bytes.")
+            # A string can't run from one section into the next, so each one gets chunked on its own.
+            return [(chunk_start, chunk_end, section, [section]) for section in selected_sections
+                    for chunk_start, chunk_end in get_chunks(section.end - section.start, section.start)]
+        logger.warning(f"{input_file_path} has no {', '.join(pe_sections)} section. Scanning the whole file.")
+
+    logger.debug(f"Scanning {file_size:,} bytes from {input_file_path}")
+    return [(chunk_start, chunk_end, None, sections) for chunk_start, chunk_end in get_chunks(file_size)]
+
+
+def scan_chunk(input_file_path: str, encoding: str, chunk_start: int, chunk_end: int, region=None, sections=()):
+    """
+    Find the strings that start between chunk_start and chunk_end. The file is memory-mapped, so only the pages we
+    touch get read.
+    Runs in a worker process, so it's self-contained.
+    :param encoding: One codec, or several comma separated. Several still means one pass over the file.
+    :param region: Section the scan has to stay inside. None = the whole file.
+    :param sections: PE sections, to record which one each string is in.
+    :return: (set of decoded strings, list of (stripped text, offset, encoded length, codec, section), dictionary of
+    error name to count)
+    """
+    extracted_strings = set()
+    occurrences = []
+    collected_errors = defaultdict(int)
+    codecs = get_codecs(encoding)
+    # One regex that matches anything any of the codecs would
+    pattern = re.compile(get_codecs_regex(codecs))
+
+    with open(input_file_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as binary_data:
+            # Start a little early too, so the scan is lined up with the previous chunk by the time we get to ours.
+            region_start, region_end = (region.start, region.end) if region else (0, len(binary_data))
+            scan_start = max(region_start, chunk_start - extract_chunk_overlap)
+            scan_end = min(region_end, chunk_end + extract_chunk_overlap)
+
+            matches = pattern.finditer(binary_data, scan_start, scan_end)
+            for match in matches:
+                if match.start() < chunk_start:
+                    continue  # The previous chunk has this one
+                if match.start() >= chunk_end:
+                    break  # The next chunk has this one
+
+                byte_sequence = match.group()
+                try:
+                    decoded_string, codec = decode_match(byte_sequence, codecs)
+                    extracted_strings.add(decoded_string)
+                    stripped_string = decoded_string.strip()
+                    if stripped_string:
+                        # Point at the stripped text, not the whitespace around it. (e.g. U+3000) Measure the
+                        # whitespace, not the text. Some cp932 chars don't encode back to the bytes they came from.
+                        leading_length = len(decoded_string[:len(decoded_string) - len(decoded_string.lstrip())]
+                                             .encode(codec))
+                        trailing_length = len(decoded_string[len(decoded_string.rstrip()):].encode(codec))
+                        offset = match.start() + leading_length
+                        encoded_length = len(byte_sequence) - 1 - leading_length - trailing_length
+                        occurrences.append((stripped_string, offset, encoded_length, codec,
+                                            PeSections.find_section(sections, offset)))
+                except UnicodeDecodeError:
+                    collected_errors["DecodeError"] += 1
+                except Exception as e:
+                    collected_errors[type(e).__name__] += 1
+                    logger.debug(f"Bytes: {match}")
+                    logger.debug(f"Issue: {e}")
+
+            # The scanner holds a view of the mmap until it's gone, and the mmap can't close while it does.
+            del matches
+
+    return extracted_strings, occurrences, dict(collected_errors)
+
+
+def decode_match(byte_sequence: bytes, codecs: list):
+    """
+    Decode a match, null byte and all, with the first codec that can. The match only has to fit one codec's pattern.
+    Decoding is the real test, and e.g. the shift_jisx0213 pattern doesn't allow the 0x85/0x86 lead bytes it decodes.
+    :param codecs: In order of preference.
+    :return: (decoded string, codec)
+    """
+    for codec in codecs[:-1]:
+        try:
+            return byte_sequence[:-1].decode(codec), codec  # Strip the null byte
+        except UnicodeDecodeError:
+            pass
+    return byte_sequence[:-1].decode(codecs[-1]), codecs[-1]
+
 
 def upsert_extracted_texts(texts):
     announce_status(f"Inserting {len(texts):,} translations")
@@ -79,28 +370,22 @@ def upsert_extracted_texts(texts):
     start_time = time.time()
 
     results = defaultdict(int)
+    # Remove extra whitespace. Can't translate whitespace.
+    stripped_texts = [text.strip() for text in texts]
+    insertable_texts = [text for text in stripped_texts if text]
+    results['Whitespace'] = len(stripped_texts) - len(insertable_texts)
+
     with sqlite_db.atomic():
-        for text in texts:
+        for batch in chunked(insertable_texts, upsert_batch_size):
             try:
-                # Remove extra whitespace
-                text = text.strip()
-
-                if not text or text.isspace():
-                    results['Whitespace'] += 1
-                    continue  # Can't translate whitespace
-
                 # Insert if it's not in here already
-                upserted_tran = Translation.insert(extracted_text=text,
-                                                   text_length=len(text)).on_conflict_ignore().execute()
-
-                if upserted_tran:
-                    results['New Phrase'] += 1
-                    logger.debug(f'New phrase: {text}')
-                else:
-                    results['Already Exists'] += 1
-                    logger.debug(f"Already inserted: {text}")
+                new_count = insert_extracted_texts_in_bulk(batch)
+
+                results['New Phrase'] += new_count
+                results['Already Exists'] += len(batch) - new_count
             except Exception as e:
-                logger.error(f"Insert failed for '{text}'\n{type(e).__name__}: {e}")
+                logger.error(f"Insert failed for {len(batch):,} texts starting with '{batch[0]}'\n"
+                             f"{type(e).__name__}: {e}")
 
     elapsed_time = time.time() - start_time
     for result in results.keys():
@@ -0,0 +1,164 @@
+"""
+Streaming mode. Extraction, validation and translation all run at once. Each chunk of the file gets scanned,
+validated and queued for translation as soon as it's ready, so the brains get to work within seconds instead of
+waiting for every other stage to finish. The translation queue is bounded. When translation falls behind, scanning
+waits for it.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from SjisMagic import DataProcessorService, SjisExtractor, ValidatorRegistry
+from SjisMagic.DatabaseService import *
+from utils import announce_status
+
+logger = logging.getLogger('streaming')
+logger.setLevel(logging.INFO)
+
+
+async def run_streaming_pipeline(input_file_path: str, encoding: str, validators: list,
+                                 brain=DataProcessorService.Brain.Ollama, queue_size=500):
+    """
+    :param validators: (exclusion_reason, validator) pairs, same as exclude_strings_via_validators.
+    :param queue_size: How many validated strings can wait for translation before scanning pauses.
+    """
+    announce_status(f'Streaming {input_file_path}')
+    start_time = time.time()
+
+    queue = asyncio.Queue(maxsize=queue_size)
+    # One consumer per request we're allowed in flight. Each one sends one request at a time.
+    translator_count = DataProcessorService.max_in_flight[brain]
+    phrases_per_request = max(1, DataProcessorService.prompt_max_phrases)
+
+    DataProcessorService.load_translation_memory()
+    DataProcessorService.start_writer()
+    translators = [asyncio.create_task(translate_from_queue(queue, brain, phrases_per_request))
+                   for _ in range(translator_count)]
+    try:
+        queued_count = await stream_validated_strings(input_file_path, encoding, validators, queue, start_time)
+
+        # Let the translators know we're done, once they've finished what's queued.
+        for _ in translators:
+            await queue.put(None)
+        request_counts = await asyncio.gather(*translators)
+    finally:
+        for translator in translators:
+            translator.cancel()
+        await DataProcessorService.stop_writer()
+
+    logger.info(f'Queued {queued_count:,} strings for translation.')
+    DataProcessorService.log_throughput('Total', sum(request_counts), time.time() - start_time)
+    DataProcessorService.log_run_stats()
+
+
+async def stream_validated_strings(input_file_path: str, encoding: str, validators: list, queue: asyncio.Queue,
+                                   start_time: float) -> int:
+    """
+    Scan the file chunk by chunk. Save what we find, run it through the validators, and queue up everything that
+    still needs translating.
+    :return: Number of strings queued.
+    """
+    loop = asyncio.get_running_loop()
+    scan_jobs = SjisExtractor.get_scan_jobs(input_file_path)
+
+    source_file = get_source_file(input_file_path)
+    fingerprint = SjisExtractor.fingerprint_file(input_file_path)
+    previous_texts = get_occurring_texts(source_file)
+    clear_occurrences(source_file)
+    found_texts = set()
+    # Validated, but not marked as such until the source check has had a look at them too.
+    checked_texts = []
+
+    queued = set()
+    exclusion_totals = {exclusion_reason: 0 for exclusion_reason, *_ in validators}
+    ordered_validators = None
+    workers = max(1, SjisExtractor.extract_workers)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else ThreadPoolExecutor(max_workers=1)
+    with executor:
+        # Keep a few chunks scanning ahead, but not the whole file. Memory stays flat when translation falls behind.
+        scans = deque()
+        scan_job_iterator = iter(scan_jobs)
+        for scan_job in scan_job_iterator:
+            scans.append(loop.run_in_executor(executor, SjisExtractor.scan_chunk, input_file_path, encoding,
+                                              *scan_job))
+            if len(scans) >= workers:
+                break
+
+        while scans:
+            chunk_strings, chunk_occurrences, chunk_errors = await scans.popleft()
+            next_scan_job = next(scan_job_iterator, None)
+            if next_scan_job is not None:
+                scans.append(loop.run_in_executor(executor, SjisExtractor.scan_chunk, input_file_path, encoding,
+                                                  *next_scan_job))
+
+            for error, count in chunk_errors.items():
+                logger.debug(f"{error}: {count:,}")
+
+            insert_occurrences(source_file, chunk_occurrences)
+            texts = {text.strip() for text in chunk_strings} - queued
+            texts.discard('')
+            found_texts.update(texts)
+            insert_extracted_texts_in_bulk(list(texts))
+
+            # Validators are plain CPU work. Keep them off the event loop, so the translators keep going.
+            # Strings that passed on an earlier run don't need another look.
+            pending_items = get_untranslated_items_in(list(texts))
+            unvalidated_texts = [item.extracted_text for item in pending_items if not item.validated]
+            if ordered_validators is None and unvalidated_texts:
+                # The first chunk is as good a sample as any.
+                ordered_validators = await loop.run_in_executor(
+                    None, ValidatorRegistry.order_validators, validators, unvalidated_texts)
+            exclusions, exclusion_counts = await loop.run_in_executor(
+                None, DataProcessorService.find_exclusions, unvalidated_texts, ordered_validators or validators)
+            exclude_strings_in_bulk(exclusions)
+            checked_texts.extend(unvalidated_texts)
+            for exclusion_reason, count in exclusion_counts.items():
+                exclusion_totals[exclusion_reason] += count
+
+            excluded_texts = {text for _, text in exclusions}
+            for item in pending_items:
+                if item.extracted_text in excluded_texts:
+                    continue
+                if not queued:
+                    logger.info(f'First string queued for translation after {time.time() - start_time:,.2f} seconds.')
+                queued.add(item.extracted_text)
+                # Blocks while the queue is full. That's the backpressure.
+                await queue.put(item)
+
+    for exclusion_reason, exclusion_count in exclusion_totals.items():
+        logger.info(f'Excluded {exclusion_count:,} strings. Reason: {exclusion_reason}')
+    # Same sanity check as the stages, once the whole file's been scanned. Whatever it throws out might have been
+    # translated already, it just won't be exported.
+    DataProcessorService.exclude_unfindable_strings(input_file_path, encoding)
+    mark_validated(checked_texts)
+    SjisExtractor.compare_string_sets(previous_texts, found_texts)
+    SjisExtractor.record_extraction(source_file, fingerprint, encoding, found_texts)
+    return len(queued)
+
+
+async def translate_from_queue(queue: asyncio.Queue, brain, phrases_per_request: int) -> int:
+    """
+    Pull strings off the queue and translate them, until we get told to stop.
+    :return: Number of requests made.
+    """
+    request_count = 0
+    done = False
+    while not done:
+        item = await queue.get()
+        if item is None:
+            break
+
+        # Grab whatever else is already waiting, up to one request's worth.
+        batch = [item]
+        while len(batch) < phrases_per_request and not queue.empty():
+            item = queue.get_nowait()
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+
+        request_count += await DataProcessorService.translate_pending(batch, brain)
+
+    return request_count
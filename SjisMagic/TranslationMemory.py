@@ -0,0 +1,127 @@
+"""
+Translation memory. Pop'n strings repeat a lot, with different numbers, widths or punctuation. Strings that match an
+earlier translation once normalized reuse it without asking a brain. Close matches get offered to the brain as
+context.
+"""
+import logging
+import re
+from collections import Counter, defaultdict
+
+import unicodedata
+
+from utils import is_placeholder
+
+logger = logging.getLogger('memory')
+logger.setLevel(logging.INFO)
+
+number_pattern = re.compile(r'\d+')
+
+
+def normalize(text: str):
+    """
+    Boil a string down to what matters for reuse. Standard width, numbers masked, no punctuation or spaces.
+    :return: (normalized key, list of the numbers that got masked)
+    """
+    standard_text = unicodedata.normalize('NFKC', text)
+    numbers = number_pattern.findall(standard_text)
+    masked_text = number_pattern.sub('#', standard_text)
+    key = ''.join(char for char in masked_text if not unicodedata.category(char).startswith(('P', 'Z')))
+    return key, numbers
+
+
+def get_ngrams(key: str, ngram_size: int) -> set:
+    if len(key) <= ngram_size:
+        return {key}
+    return {key[i:i + ngram_size] for i in range(len(key) - ngram_size + 1)}
+
+
+class TranslationMemory:
+    def __init__(self, ngram_size: int = 2):
+        self.ngram_size = ngram_size
+        # Normalized key -> (original text, its numbers, translation)
+        self.entries = {}
+        # N-gram -> keys that contain it
+        self.ngram_index = defaultdict(set)
+        self.stats = {'exact_hits': 0, 'fuzzy_offers': 0, 'misses': 0}
+
+    def add(self, text: str, translation: str):
+        key, numbers = normalize(text)
+        # Placeholders aren't translations. Offered as examples, they'd only teach the brain to answer with them.
+        if not key or key in self.entries or not translation or is_placeholder(translation):
+            return
+
+        self.entries[key] = (text, numbers, translation)
+        for ngram in get_ngrams(key, self.ngram_size):
+            self.ngram_index[ngram].add(key)
+
+    def lookup(self, text: str):
+        """
+        Find a translation we can reuse as is.
+        :return: The translation, with numbers swapped in for this string's numbers. None if nothing fits.
+        """
+        key, numbers = normalize(text)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+
+        _, entry_numbers, entry_translation = entry
+        translation = swap_numbers(entry_translation, entry_numbers, numbers)
+        if translation is None:
+            self.stats['misses'] += 1
+            return None
+
+        self.stats['exact_hits'] += 1
+        return translation
+
+    def find_similar(self, text: str, limit: int = 3, min_similarity: float = 0.5) -> list:
+        """
+        Find earlier translations of similar strings, best first.
+        :return: (original text, translation, similarity) tuples. Similarity is the Dice coefficient of the n-grams.
+        """
+        key, _ = normalize(text)
+        if not key:
+            return []
+
+        ngrams = get_ngrams(key, self.ngram_size)
+        shared_counts = Counter()
+        for ngram in ngrams:
+            shared_counts.update(self.ngram_index.get(ngram, ()))
+
+        similar = []
+        for candidate_key, shared_count in shared_counts.items():
+            if candidate_key == key:
+                continue
+            candidate_ngram_count = len(get_ngrams(candidate_key, self.ngram_size))
+            similarity = 2 * shared_count / (len(ngrams) + candidate_ngram_count)
+            if similarity >= min_similarity:
+                candidate_text, _, candidate_translation = self.entries[candidate_key]
+                similar.append((candidate_text, candidate_translation, similarity))
+
+        similar.sort(key=lambda match: match[2], reverse=True)
+        if similar:
+            self.stats['fuzzy_offers'] += 1
+        return similar[:limit]
+
+    def log_stats(self):
+        logger.info(f"Translation memory: {len(self.entries):,} entries. Reused {self.stats['exact_hits']:,} "
+                    f"translations (model calls avoided), offered similar translations as context "
+                    f"{self.stats['fuzzy_offers']:,} times.")
+
+
+def swap_numbers(translation: str, old_numbers: list, new_numbers: list):
+    """
+    Put new numbers into a translation, in place of the ones from the original string.
+    :return: The adjusted translation, or None if we can't tell which number is which.
+    """
+    if old_numbers == new_numbers:
+        return translation
+    if len(old_numbers) != len(new_numbers):
+        return None
+
+    # Only safe when the translation has exactly the original's numbers, in the same order.
+    if number_pattern.findall(translation) != old_numbers:
+        return None
+
+    replacements = iter(new_numbers)
+    return number_pattern.sub(lambda _: next(replacements), translation)
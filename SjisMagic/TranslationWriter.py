@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+
+from SjisMagic.DatabaseService import update_translations_in_bulk
+
+logger = logging.getLogger('writer')
+logger.setLevel(logging.INFO)
+
+# Queue markers. One saves what we have right away, the other saves and stops.
+_flush_marker = 'flush'
+_close_marker = 'close'
+
+
+class TranslationWriter:
+    """
+    Single writer for translation results. Workers submit results and move on, the writer saves them in short bulk
+    transactions, whenever it has max_batch results or the oldest one has waited max_delay seconds.
+    Nothing holds a write lock across a network call, and a crash loses at most one flush worth of work.
+    """
+
+    def __init__(self, max_batch: int = 200, max_delay: float = 2.0):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.saved_count = 0
+        self.flush_count = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def submit(self, extracted_text: str, translation: str):
+        self.queue.put_nowait((extracted_text, translation))
+
+    async def wait_until_saved(self):
+        """
+        Save everything submitted so far, without waiting for the deadline.
+        """
+        self.queue.put_nowait(_flush_marker)
+        await self.queue.join()
+
+    async def close(self):
+        """
+        Save everything still queued, then stop.
+        """
+        self.queue.put_nowait(_close_marker)
+        await self.task
+        logger.info(f'Saved {self.saved_count:,} translations in {self.flush_count:,} writes.')
+
+    async def run(self):
+        closing = False
+        while not closing:
+            # Wait for the first result, then give the rest of the batch until the deadline to show up.
+            item = await self.queue.get()
+            if item == _close_marker:
+                self.queue.task_done()
+                break
+            if item == _flush_marker:
+                self.queue.task_done()
+                continue
+
+            pending = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(pending) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item == _close_marker or item == _flush_marker:
+                    self.queue.task_done()
+                    closing = item == _close_marker
+                    break
+                pending.append(item)
+
+            self.flush(pending)
+            for _ in pending:
+                self.queue.task_done()
+
+    def flush(self, pending: list):
+        try:
+            update_translations_in_bulk([(translation, extracted_text) for extracted_text, translation in pending])
+            self.saved_count += len(pending)
+            self.flush_count += 1
+            logger.debug(f'Saved {len(pending):,} translations.')
+        except Exception as e:
+            # Don't take the whole run down. These rows just stay untranslated until next time.
+            logger.error(f'Failed to save {len(pending):,} translations. {type(e).__name__}: {e}')
@@ -0,0 +1,110 @@
+"""
+Validator registry. Validators get timed and checked for how much they reject on a sample of the strings, then run
+cheapest-per-rejection first. Strings stop at the first validator they fail, so a cheap validator that throws out a
+lot of strings saves every validator after it the trouble. Validators marked expensive run in a process pool.
+"""
+import logging
+import os
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from decouple import config
+
+from SjisMagic import Metrics
+
+logger = logging.getLogger('validators')
+logger.setLevel(logging.INFO)
+
+# validator returns True = include, False = exclude
+Validator = namedtuple('Validator', ['exclusion_reason', 'validator', 'expensive'], defaults=[False])
+
+adaptive_order = config('ADAPTIVE_VALIDATOR_ORDER', default=True, cast=bool)
+sample_size = config('VALIDATOR_SAMPLE_SIZE', default=1_000, cast=int)
+validator_workers = config('VALIDATOR_WORKERS', default=os.cpu_count() or 1, cast=int)
+# Strings per job sent to the pool. Big enough that pickling doesn't eat the gains.
+pool_chunk_size = 2_000
+
+_validators = []
+_pool = None
+
+
+def register(exclusion_reason: str, validator, expensive=False):
+    """
+    :param validator: Function that takes a string. True = include, False = exclude. Has to pickle if it's expensive.
+    (A module level function, or a functools.partial of one.)
+    :param expensive: Run it in a process pool.
+    """
+    _validators.append(Validator(exclusion_reason, validator, expensive))
+
+
+def get_registered() -> list:
+    return list(_validators)
+
+
+def order_validators(validators: list, texts: list) -> list:
+    """
+    Sort validators by measured cost per rejection, on a sample of the strings. The set of strings that get excluded
+    doesn't change, only which reason a string gets when it would fail more than one validator.
+    :return: The validators, in the order to run them.
+    """
+    validators = [Validator(*validator) for validator in validators]
+    if not adaptive_order or len(validators) < 2 or not texts:
+        return validators
+
+    sample = random.Random(0).sample(texts, min(sample_size, len(texts)))
+    validator_stats = [measure(validator, sample) for validator in validators]
+
+    # Expected cost of running the chain is lowest when each validator's cost / rejection rate is as low as can be.
+    # Validators that never reject go last, cheapest first.
+    ordered = sorted(zip(validators, validator_stats),
+                     key=lambda pair: (pair[1]['rejection_rate'] == 0,
+                                       pair[1]['seconds_per_string'] / (pair[1]['rejection_rate'] or 1)))
+
+    logger.info(f'Validator order, measured on {len(sample):,} strings:')
+    for validator, stats in ordered:
+        logger.info(f"  {validator.exclusion_reason}: {stats['seconds_per_string'] * 1_000_000:,.2f}µs per string, "
+                    f"rejects {stats['rejection_rate']:.1%}{' (process pool)' if validator.expensive else ''}")
+    Metrics.add_section('validators', [{'exclusion_reason': validator.exclusion_reason,
+                                        'expensive': validator.expensive, **stats} for validator, stats in ordered])
+    return [validator for validator, _ in ordered]
+
+
+def measure(validator: Validator, sample: list) -> dict:
+    # Warm up first. Some validators build lookup tables on their first call.
+    validator.validator(sample[0])
+    start_time = time.perf_counter()
+    rejections = sum(1 for text in sample if not validator.validator(text))
+    elapsed_time = time.perf_counter() - start_time
+    return {
+        'seconds_per_string': elapsed_time / len(sample),
+        'rejection_rate': rejections / len(sample),
+    }
+
+
+def check_texts(validator, texts: list) -> list:
+    # Runs in the pool, so it's self-contained.
+    return [validator(text) for text in texts]
+
+
+def run_validator(validator: Validator, texts: list) -> list:
+    """
+    :return: The validator's verdict for each string, in order.
+    """
+    if not validator.expensive or validator_workers <= 1 or len(texts) <= pool_chunk_size:
+        return check_texts(validator.validator, texts)
+
+    chunks = [texts[i:i + pool_chunk_size] for i in range(0, len(texts), pool_chunk_size)]
+    verdicts = []
+    for chunk_verdicts in get_pool().map(check_texts, [validator.validator] * len(chunks), chunks):
+        verdicts.extend(chunk_verdicts)
+    return verdicts
+
+
+def get_pool() -> ProcessPoolExecutor:
+    # Starting processes isn't free. Keep the pool around for the rest of the run.
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=validator_workers)
+    return _pool
@@ -0,0 +1,67 @@
+"""
+Compare the per-character Japanese check against the lookup table, on the strings from a real binary.
+
+Run from the repo root:
+    python -m benchmarks.bench_japanese_percentage [path/to/popn22.dll]
+"""
+import re
+import sys
+import time
+
+from SjisMagic import DataProcessorService
+
+
+def load_strings(input_file_path: str) -> list:
+    with open(input_file_path, 'rb') as file:
+        binary_data = file.read()
+
+    strings = set()
+    for match in re.finditer(b'[\x81-\x9f\xe0-\xef][\x40-\x7e\x80-\xfc]+\x00', binary_data):
+        try:
+            strings.add(match.group()[:-1].decode('cp932'))
+        except UnicodeDecodeError:
+            pass
+    return list(strings)
+
+
+def calc_japanese_percentage_per_char(input_string):
+    # The old way. Ask is_char_japanese about every character.
+    if not input_string:
+        return 0
+    return sum(DataProcessorService.is_char_japanese(char) for char in input_string) / len(input_string) * 100
+
+
+def time_pass(func, strings: list, rounds: int):
+    best = None
+    results = None
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        results = [func(string) for string in strings]
+        elapsed_time = time.perf_counter() - start_time
+        best = elapsed_time if best is None else min(best, elapsed_time)
+    return best, results
+
+
+def main():
+    input_file_path = sys.argv[1] if len(sys.argv) > 1 else 'working/popn22.dll'
+    strings = load_strings(input_file_path)
+    char_count = sum(len(string) for string in strings)
+    print(f'{len(strings):,} strings, {char_count:,} chars from {input_file_path}')
+
+    start_time = time.perf_counter()
+    DataProcessorService.get_japanese_char_table()
+    print(f'Table build (once per run): {time.perf_counter() - start_time:.3f}s')
+
+    per_char_time, per_char_results = time_pass(calc_japanese_percentage_per_char, strings, rounds=5)
+    table_time, table_results = time_pass(DataProcessorService.calc_japanese_percentage, strings, rounds=5)
+
+    if per_char_results != table_results:
+        raise Exception('Lookup table disagrees with is_char_japanese!')
+
+    print(f'Per char: {per_char_time:.4f}s ({char_count / per_char_time:,.0f} chars/sec)')
+    print(f'Table:    {table_time:.4f}s ({char_count / table_time:,.0f} chars/sec)')
+    print(f'Speedup:  {per_char_time / table_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
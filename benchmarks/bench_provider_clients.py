@@ -0,0 +1,57 @@
+"""
+Time what the provider registry saves. Startup: importing the translation code with and without every provider SDK
+loaded up front. Per call: a new client for every request (the old way) vs one shared client, against a local
+stand-in for Ollama, so no API keys are needed. The stand-in is plain HTTP on localhost. Against a hosted API, a new
+client also means a new TLS handshake, so the real savings are bigger.
+
+Run from the repo root:
+    python -m benchmarks.bench_provider_clients [calls]
+"""
+import subprocess
+import sys
+import time
+
+from SjisMagic import OllamaService
+from benchmarks.fake_llm_server import FakeProviderServer, FakeProviderSettings
+
+
+def time_import(statement: str, rounds: int = 5) -> float:
+    # Fresh interpreter every time, or the second import is free.
+    best = None
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], check=True)
+        elapsed_time = time.perf_counter() - start_time
+        best = elapsed_time if best is None else min(best, elapsed_time)
+    return best
+
+
+def time_calls(get_client, host: str, calls: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(calls):
+        get_client(host).generate(model=OllamaService.MODEL, prompt='スタート')
+    return (time.perf_counter() - start_time) / calls
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    lazy_time = time_import('import SjisMagic.DataProcessorService')
+    eager_time = time_import('import openai, anthropic, ollama, SjisMagic.DataProcessorService')
+    print(f'Startup   all SDKs up front {eager_time * 1000:8.1f}ms   lazy {lazy_time * 1000:8.1f}ms')
+
+    import ollama
+    # No latency, no errors. Only the client side differs.
+    server = FakeProviderServer(FakeProviderSettings()).start()
+    host = server.url
+
+    shared_client = ollama.Client(host=host)
+    new_client_time = time_calls(lambda client_host: ollama.Client(host=client_host), host, calls)
+    shared_client_time = time_calls(lambda _: shared_client, host, calls)
+    print(f'Per call  new client {new_client_time * 1000:8.3f}ms   shared client {shared_client_time * 1000:8.3f}ms   '
+          f'({calls:,} calls)')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Time the translation work queue queries at different table sizes, with SQLite defaults vs the tuned profile
+(pragmas + partial index).
+
+Run from the repo root:
+    python -m benchmarks.bench_sqlite_queue [row counts...]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from SjisMagic import DatabaseService
+from SjisMagic.DatabaseService import Translation, sqlite_db
+
+
+def fill_table(row_count: int):
+    # Roughly what a real run looks like. Most strings get excluded, most of the rest get translated.
+    random.seed(row_count)
+    # Every column gets a value, with the model's defaults for the ones we don't care about. Same as
+    # DatabaseService.insert_extracted_texts_in_bulk, so new columns don't break this.
+    fields = Translation._meta.sorted_fields
+    columns = ', '.join(f'"{field.column_name}"' for field in fields)
+    placeholders = ', '.join('?' for _ in fields)
+    defaults = {field.name: field.default() if callable(field.default) else field.default for field in fields}
+    rows = []
+    for i in range(row_count):
+        excluded = random.random() < 0.6
+        translated = not excluded and random.random() < 0.8
+        row = dict(defaults, extracted_text=f'文字列{i:08d}', translation='Translated' if translated else '',
+                   exclude_from_translation=int(excluded), text_length=len(str(i)) + 3)
+        rows.append([row[field.name] for field in fields])
+
+    with sqlite_db.atomic():
+        sqlite_db.cursor().executemany(
+            f'INSERT INTO "{Translation._meta.table_name}" ({columns}) VALUES ({placeholders})', rows)
+
+
+def time_query(func, rounds: int = 5) -> float:
+    best = None
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        func()
+        elapsed_time = time.perf_counter() - start_time
+        best = elapsed_time if best is None else min(best, elapsed_time)
+    return best
+
+
+def run_profile(row_count: int, tuned: bool) -> dict:
+    with tempfile.TemporaryDirectory() as temp_folder:
+        sqlite_db.init(os.path.join(temp_folder, 'bench.db'), pragmas=DatabaseService.sqlite_pragmas if tuned else {})
+        sqlite_db.connect()
+        sqlite_db.create_tables([Translation])
+        if not tuned:
+            sqlite_db.execute_sql('DROP INDEX translation_pending')
+        fill_table(row_count)
+
+        results = {
+            'pending count': time_query(DatabaseService.get_untranslated_items_count),
+            'pending batch of 100': time_query(lambda: list(DatabaseService.get_untranslated_items(100))),
+            'review list': time_query(lambda: list(Translation.select(Translation.extracted_text)
+                                                   .where(Translation.exclude_from_translation == 0).tuples())),
+        }
+        sqlite_db.close()
+    return results
+
+
+def main():
+    row_counts = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for row_count in row_counts:
+        default_results = run_profile(row_count, tuned=False)
+        tuned_results = run_profile(row_count, tuned=True)
+        print(f'{row_count:,} rows')
+        for query in default_results:
+            print(f'  {query:<22} default {default_results[query] * 1000:9.2f}ms   '
+                  f'tuned {tuned_results[query] * 1000:9.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
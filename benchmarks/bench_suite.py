@@ -0,0 +1,132 @@
+"""
+Benchmark suite. Generates synthetic binaries at a few sizes and times extraction, the bulk insert, every validator
+and the .dict export on each. Results are saved as JSON, pass an earlier results file to see what changed.
+
+Run from the repo root:
+    python -m benchmarks.bench_suite [--sizes 1,8,32] [--encoding cp932[,shift_jisx0213...]] [--output results.json]
+                                     [--compare earlier_results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+from datetime import datetime
+
+import main as sjismagic_main
+from SjisMagic import DataProcessorService, DatabaseService, FileUtilities, SjisExtractor, ValidatorRegistry
+from SjisMagic.DatabaseService import Occurrence, SourceFile, Translation, sqlite_db
+from benchmarks.synthetic_binary import generate_binary
+
+
+def get_validators() -> list:
+    # The ones main.py runs, plus the one it has switched off.
+    return sjismagic_main.get_validators() + [
+        ValidatorRegistry.Validator("Half Width Latin Chars", DataProcessorService.are_latin_chars_fullwidth)]
+
+
+def timed(func, *args):
+    start_time = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start_time, result
+
+
+def run_size(size_mb: float, encoding: str, temp_folder: str) -> list:
+    binary_path = os.path.join(temp_folder, f'synthetic_{size_mb}mb.bin')
+    planted = generate_binary(binary_path, int(size_mb * 1024 * 1024))
+
+    sqlite_db.init(os.path.join(temp_folder, f'bench_{size_mb}mb.db'), pragmas=DatabaseService.sqlite_pragmas)
+    sqlite_db.connect()
+    sqlite_db.create_tables([Translation, SourceFile, Occurrence])
+    results = []
+
+    def record(benchmark: str, seconds: float, items: int, **extra):
+        results.append({'size_mb': size_mb, 'benchmark': benchmark, 'seconds': seconds, 'items': items,
+                        'items_per_sec': items / seconds if seconds else 0, **extra})
+        print(f'  {benchmark:<36} {seconds:9.3f}s {items:>10,} items')
+
+    print(f'{size_mb:,}MB, {len(planted):,} planted strings ({encoding})')
+    seconds, _ = timed(SjisExtractor.extract_strings, binary_path, encoding, True)
+    texts = [text for (text,) in Translation.select(Translation.extracted_text).tuples()]
+    # Only strings in a flavour the codecs cover can be found.
+    findable = [text for text in planted if can_encode(text, encoding)]
+    recall = len(set(findable) & set(texts)) / len(findable) if findable else 0
+    record('extract_strings', seconds, os.path.getsize(binary_path), recall=recall)
+    print(f'  {recall:.1%} of the findable planted strings were extracted')
+
+    # Insert into an empty table, same as a first run.
+    Translation.delete().execute()
+    seconds, _ = timed(SjisExtractor.upsert_extracted_texts, texts)
+    record('upsert_extracted_texts', seconds, len(texts))
+
+    for validator in get_validators():
+        # Warm up first, same as ValidatorRegistry.measure. Some validators build lookup tables on their first call.
+        validator.validator(texts[0])
+        seconds, verdicts = timed(ValidatorRegistry.check_texts, validator.validator, texts)
+        record(f'validator: {validator.exclusion_reason}', seconds, len(texts), rejected=verdicts.count(False))
+
+    Translation.update(translation='Translated').execute()
+    dict_path = os.path.join(temp_folder, f'bench_{size_mb}mb.dict')
+    seconds, _ = timed(FileUtilities.write_popnhax_dict, dict_path)
+    record('write_popnhax_dict', seconds, len(texts))
+
+    sqlite_db.close()
+    return results
+
+
+def can_encode(text: str, encoding: str) -> bool:
+    for codec in SjisExtractor.get_codecs(encoding):
+        try:
+            text.encode(codec)
+            return True
+        except UnicodeEncodeError:
+            pass
+    return False
+
+
+def compare(results: list, earlier_results_path: str):
+    with open(earlier_results_path, encoding='utf-8') as earlier_file:
+        earlier = {(result['size_mb'], result['benchmark']): result for result in json.load(earlier_file)['results']}
+
+    print(f'Compared to {earlier_results_path}:')
+    for result in results:
+        earlier_result = earlier.get((result['size_mb'], result['benchmark']))
+        if earlier_result is None or not result['seconds']:
+            continue
+        ratio = earlier_result['seconds'] / result['seconds']
+        print(f"  {result['size_mb']:>6,}MB {result['benchmark']:<36} {earlier_result['seconds']:9.3f}s -> "
+              f"{result['seconds']:9.3f}s ({ratio:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SjisMagic benchmark suite')
+    parser.add_argument('--sizes', default='1,8,32', help='Binary sizes in MB, comma separated')
+    parser.add_argument('--encoding', default='cp932',
+                        help='sjis, cp932 or shift_jisx0213. Or several, comma separated, for the single scan mode')
+    parser.add_argument('--output', default=f'bench-results-{datetime.now():%Y%m%d-%H%M%S}.json')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_folder:
+        for size_mb in [float(size) for size in args.sizes.split(',')]:
+            results.extend(run_size(size_mb, args.encoding, temp_folder))
+
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump({
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'encoding': args.encoding,
+            'results': results,
+        }, output_file, indent=2)
+    print(f'Saved results: {args.output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
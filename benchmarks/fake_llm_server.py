@@ -0,0 +1,238 @@
+"""
+Local stand-in for the LLM providers. Speaks Ollama's /api/generate and OpenAI's /v1/chat/completions, answers with
+made up (but well formed) translations, and can be slow or fail on purpose. For tuning batch sizes, in-flight limits
+and retries without paying for it.
+
+Point a run at it with OLLAMA_HOST=http://127.0.0.1:<port> and OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+Run from the repo root:
+    python -m benchmarks.fake_llm_server [--port 11434] [--latency lognormal] [--latency-ms 300] [--rate-429 0.05]
+"""
+import argparse
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Pulls the phrases back out of the prompts we send. See utils.build_batch_prompt and OpenAIService.translate.
+batch_prompt_regex = re.compile(r'Translate each of these phrases: (\[.*?\])\n', re.DOTALL)
+openai_prompt_regex = re.compile(r'Translate "(.*)"\. Do not use more than', re.DOTALL)
+
+fake_words = ['Start', 'Music', 'Select', 'Song', 'Play', 'Clear', 'Score', 'Time', 'Level', 'Mode', 'Hard', 'Easy']
+
+
+class FakeProviderSettings:
+    """
+    How the fake behaves.
+    :param latency: 'fixed', 'uniform' (0 to 2x latency_ms) or 'lognormal' (median latency_ms, spread sigma).
+    :param per_phrase_ms: Extra time per phrase in a batch request. Bigger prompts take longer.
+    :param rate_429: Share of requests answered with 429 Too Many Requests.
+    :param rate_5xx: Share of requests answered with a 500, 502 or 503.
+    :param retry_after: Retry-After seconds sent with a 429. 0 = don't send one.
+    """
+
+    def __init__(self, latency='fixed', latency_ms=0.0, sigma=0.5, per_phrase_ms=0.0, rate_429=0.0, rate_5xx=0.0,
+                 retry_after=0.0, seed=None):
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.per_phrase_ms = per_phrase_ms
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        # Handlers run on their own threads. random.Random isn't safe to share without this.
+        self.lock = threading.Lock()
+
+    def get_delay(self, phrase_count: int) -> float:
+        with self.lock:
+            if self.latency == 'uniform':
+                delay_ms = self.rng.uniform(0, 2 * self.latency_ms)
+            elif self.latency == 'lognormal':
+                delay_ms = self.rng.lognormvariate(math.log(self.latency_ms), self.sigma) if self.latency_ms else 0
+            else:
+                delay_ms = self.latency_ms
+        return (delay_ms + self.per_phrase_ms * phrase_count) / 1000
+
+    def get_injected_status(self):
+        # None = answer normally
+        with self.lock:
+            roll = self.rng.random()
+            if roll < self.rate_429:
+                return 429
+            if roll < self.rate_429 + self.rate_5xx:
+                return self.rng.choice([500, 502, 503])
+        return None
+
+
+def fake_translation(text: str) -> str:
+    # Same phrase, same translation. Never longer than the original, so nothing trips over the length checks.
+    words = []
+    for index, char in enumerate(text[:3]):
+        words.append(fake_words[(ord(char) + index) % len(fake_words)])
+    return ' '.join(words)[:max(len(text), 1)]
+
+
+def build_translations_json(texts: list) -> str:
+    return json.dumps({'translations': [{'original': text, 'translation': fake_translation(text)} for text in texts]},
+                      ensure_ascii=False)
+
+
+def get_batch_phrases(prompt: str):
+    """
+    :return: The phrases in a batch prompt, None if it's not one.
+    """
+    match = batch_prompt_regex.search(prompt)
+    return json.loads(match.group(1)) if match else None
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real thing. Without it there's no connection to reuse.
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out as separate writes. Don't let Nagle hold the body back.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path.rstrip('/') == '/api/generate':
+            self.handle_request(request, self.build_ollama_response)
+        elif self.path.rstrip('/').endswith('/chat/completions'):
+            self.handle_request(request, self.build_openai_response)
+        else:
+            self.send_json(404, {'error': f'Not found: {self.path}'})
+
+    def handle_request(self, request: dict, build_response):
+        settings = self.server.settings
+        status_code, body, phrase_count = build_response(request)
+        time.sleep(settings.get_delay(phrase_count))
+
+        injected_status = settings.get_injected_status()
+        self.server.record(self.path, injected_status or status_code, phrase_count)
+        if injected_status == 429:
+            headers = {'Retry-After': f'{settings.retry_after:g}'} if settings.retry_after else {}
+            self.send_json(429, {'error': 'Rate limit reached. Please slow down.'}, headers)
+        elif injected_status:
+            self.send_json(injected_status, {'error': 'The server had an error processing your request.'})
+        else:
+            self.send_json(status_code, body)
+
+    @staticmethod
+    def build_ollama_response(request: dict):
+        prompt = request.get('prompt', '')
+        phrases = get_batch_phrases(prompt)
+        if request.get('format') == 'json':
+            response_text = build_translations_json(phrases if phrases is not None else [prompt])
+        else:
+            response_text = fake_translation(prompt)
+        return 200, {
+            'model': request.get('model', ''),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'response': response_text,
+            'done': True,
+            'done_reason': 'stop',
+        }, len(phrases) if phrases is not None else 1
+
+    @staticmethod
+    def build_openai_response(request: dict):
+        prompt = next((message['content'] for message in reversed(request.get('messages', []))
+                       if message.get('role') == 'user'), '')
+        phrases = get_batch_phrases(prompt)
+        if phrases is None:
+            match = openai_prompt_regex.search(prompt)
+            phrases = [match.group(1) if match else prompt]
+        return 200, {
+            'id': f'chatcmpl-fake{time.monotonic_ns()}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', ''),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': build_translations_json(phrases)},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': len(prompt), 'completion_tokens': 0, 'total_tokens': len(prompt)},
+        }, len(phrases)
+
+    def send_json(self, status_code: int, body: dict, headers: dict = None):
+        encoded_body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded_body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(encoded_body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings: FakeProviderSettings, host='127.0.0.1', port=0):
+        super().__init__((host, port), FakeProviderHandler)
+        self.settings = settings
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def record(self, path: str, status_code: int, phrase_count: int):
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats[f'status {status_code}'] += 1
+            if status_code == 200:
+                self.stats['phrases'] += phrase_count
+
+    def start(self) -> 'FakeProviderServer':
+        # In the background, for running alongside the pipeline in one process.
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def add_settings_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--latency', default='lognormal', choices=['fixed', 'uniform', 'lognormal'])
+    parser.add_argument('--latency-ms', type=float, default=200, help='Fixed/mean/median latency')
+    parser.add_argument('--sigma', type=float, default=0.5, help='Spread for lognormal latency')
+    parser.add_argument('--per-phrase-ms', type=float, default=5, help='Extra latency per phrase in a batch')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Share of requests that get a 429')
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help='Share of requests that get a 500/502/503')
+    parser.add_argument('--retry-after', type=float, default=0.0, help='Retry-After seconds sent with a 429')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def get_settings(args: argparse.Namespace) -> FakeProviderSettings:
+    return FakeProviderSettings(latency=args.latency, latency_ms=args.latency_ms, sigma=args.sigma,
+                                per_phrase_ms=args.per_phrase_ms, rate_429=args.rate_429, rate_5xx=args.rate_5xx,
+                                retry_after=args.retry_after, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Ollama/OpenAI server')
+    parser.add_argument('--port', type=int, default=11434)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+    server = FakeProviderServer(get_settings(args), port=args.port)
+    print(f'Listening on {server.url}. OLLAMA_HOST={server.url} OPENAI_BASE_URL={server.url}/v1')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(dict(server.stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+End to end load test. Runs the whole main() pipeline (extract, validate, translate, export) against the fake provider
+server, on a synthetic binary or a file of your own, then reports throughput, request latency and how well failures
+were recovered from. Everything (database, LLM cache, .dict, run report, log) goes in a scratch folder, so runs don't
+touch your real data or each other.
+
+Pipeline settings come from the environment like always, so compare e.g.
+    PROMPT_MAX_PHRASES=1 OLLAMA_MAX_IN_FLIGHT=2 python -m benchmarks.load_test
+    PROMPT_MAX_PHRASES=20 OLLAMA_MAX_IN_FLIGHT=8 python -m benchmarks.load_test --rate-429 0.05
+Only the Ollama and ChatGPT brains have a fake. (ENSEMBLE_BRAINS=Ollama,ChatGPT works.)
+
+Run from the repo root:
+    python -m benchmarks.load_test [--size-mb 1] [--input file.dll] [--latency-ms 200] [--rate-5xx 0.02]
+                                   [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.fake_llm_server import FakeProviderServer, add_settings_arguments, get_settings
+from benchmarks.synthetic_binary import generate_binary
+
+
+def setup_environment(server_url: str, work_folder: str, input_file_path: str):
+    # Has to happen before SjisMagic is imported. Settings are read at import time.
+    os.environ.update({
+        'OLLAMA_HOST': server_url,
+        'OPENAI_BASE_URL': f'{server_url}/v1',
+        'OPENAI_API_KEY': 'fake',
+        'INPUT_FILES': '',
+        'INPUT_FILE_PATH': input_file_path,
+        'OUTPUT_FILE_PATH': os.path.join(work_folder, 'output.dict'),
+        'LLM_CACHE_PATH': os.path.join(work_folder, 'llmCache.db'),
+        'RUN_REPORT_PATH': os.path.join(work_folder, 'report.json'),
+    })
+
+
+def run_pipeline(work_folder: str) -> float:
+    import main as sjismagic_main
+    from SjisMagic import DatabaseService
+
+    # The database and log go wherever we're running from.
+    os.makedirs(os.path.join(work_folder, DatabaseService.database_folder), exist_ok=True)
+    DatabaseService.sqlite_db.init(
+        os.path.join(work_folder, DatabaseService.database_folder, DatabaseService.database_name),
+        pragmas=DatabaseService.sqlite_pragmas)
+    original_folder = os.getcwd()
+    os.chdir(work_folder)
+    try:
+        start_time = time.perf_counter()
+        asyncio.run(sjismagic_main.main())
+        return time.perf_counter() - start_time
+    finally:
+        os.chdir(original_folder)
+
+
+def summarize(report: dict, server_stats: dict, wall_seconds: float) -> dict:
+    from SjisMagic.DatabaseService import Translation, get_untranslated_items_count
+
+    translated = (Translation.select().where((Translation.exclude_from_translation == 0) &
+                                             (Translation.translation != '')).count())
+    # Streaming runs translate during the 'stream' stage.
+    translate_stage = report['stages'].get('translate') or report['stages'].get('stream') or {}
+    translate_seconds = translate_stage.get('seconds', 0)
+    injected_errors = sum(count for key, count in server_stats.items()
+                          if key.startswith('status ') and key != 'status 200')
+    failures = sum(provider_stats['failures'] for provider_stats in report['providers'].values())
+    return {
+        'wall_seconds': wall_seconds,
+        'translate_seconds': translate_seconds,
+        'phrases_translated': translated,
+        'phrases_left': get_untranslated_items_count(),
+        'phrases_per_sec': translated / translate_seconds if translate_seconds else 0,
+        'requests_per_sec': server_stats.get('requests', 0) / translate_seconds if translate_seconds else 0,
+        'injected_errors': injected_errors,
+        'retries': sum(provider_stats['retries'] for provider_stats in report['providers'].values()),
+        'failures': failures,
+        'recovered': get_recovered_share(injected_errors, failures),
+        'providers': report['providers'],
+        'server': server_stats,
+        'stages': report['stages'],
+    }
+
+
+def get_recovered_share(injected_errors: int, failures: int):
+    """
+    :return: Share of injected errors that a retry got past. None if nothing was injected and nothing failed.
+    """
+    if injected_errors:
+        # Failures that weren't injected (bad responses...) count against it too.
+        return max(0.0, (injected_errors - failures) / injected_errors)
+    # Nothing to recover from, so any failure is one we didn't cause.
+    return 0.0 if failures else None
+
+
+def print_summary(summary: dict):
+    print(f"Wall {summary['wall_seconds']:,.2f}s, translate stage {summary['translate_seconds']:,.2f}s")
+    print(f"Translated {summary['phrases_translated']:,} phrases, {summary['phrases_left']:,} left. "
+          f"{summary['phrases_per_sec']:,.1f} phrases/s, {summary['requests_per_sec']:,.1f} requests/s")
+    for provider, provider_stats in summary['providers'].items():
+        latency = provider_stats['latency_ms']
+        print(f"{provider}: {provider_stats['requests']:,} requests. p50 {latency['p50']:,.0f}ms "
+              f"p95 {latency['p95']:,.0f}ms p99 {latency['p99']:,.0f}ms max {latency['max']:,.0f}ms")
+    recovered = 'n/a' if summary['recovered'] is None else f"{summary['recovered']:.1%}"
+    print(f"Injected {summary['injected_errors']:,} errors. {summary['retries']:,} retries, "
+          f"{summary['failures']:,} gave up ({recovered} recovered)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SjisMagic end to end load test')
+    parser.add_argument('--size-mb', type=float, default=1, help='Size of the synthetic binary')
+    parser.add_argument('--input', help='Use this file instead of a synthetic binary')
+    parser.add_argument('--output', default=f'load-test-{datetime.now():%Y%m%d-%H%M%S}.json')
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeProviderServer(get_settings(args)).start()
+    with tempfile.TemporaryDirectory(prefix='sjismagic-load-') as work_folder:
+        if args.input:
+            input_file_path = os.path.abspath(args.input)
+        else:
+            input_file_path = os.path.join(work_folder, 'synthetic.bin')
+            generate_binary(input_file_path, int(args.size_mb * 1024 * 1024), seed=args.seed or 0)
+        setup_environment(server.url, work_folder, input_file_path)
+
+        wall_seconds = run_pipeline(work_folder)
+        server.shutdown()
+        with open(os.environ['RUN_REPORT_PATH'], encoding='utf-8') as report_file:
+            summary = summarize(json.load(report_file), dict(server.stats), wall_seconds)
+
+    print_summary(summary)
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump({
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'input': args.input or f'synthetic {args.size_mb:,}MB',
+            'fake_server': {key: value for key, value in vars(args).items() if key not in ('input', 'output')},
+            # The settings being tuned
+            'settings': {key: value for key, value in os.environ.items()
+                         if key.endswith(('_MAX_IN_FLIGHT', '_PER_MINUTE'))
+                         or key.startswith(('PROMPT_', 'ENSEMBLE_', 'PE_SECTIONS'))
+                         or key in ('MAX_RETRIES', 'TEXT_CODEC', 'TRANSLATION_MEMORY', 'STREAMING_PIPELINE')},
+            **summary,
+        }, output_file, indent=2, ensure_ascii=False)
+    print(f'Saved results: {args.output}')
+
+
+if __name__ == '__main__':
+    main()
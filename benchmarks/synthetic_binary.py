@@ -0,0 +1,78 @@
+"""
+Synthetic stand-ins for game binaries. Null-terminated Shift-JIS strings (sjis, cp932 and shift_jisx0213 flavours)
+scattered through random noise, at whatever size you need. Same seed, same file.
+
+Run from the repo root:
+    python -m benchmarks.synthetic_binary output_path [size_mb] [seed]
+"""
+import random
+import sys
+
+codec_names = {'sjis': 'shift_jis', 'cp932': 'cp932', 'shift_jisx0213': 'shift_jisx0213'}
+
+# Stuff every flavour can encode
+common_chars = ('あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん'
+                'アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワヲン'
+                '音楽曲選択開始終了設定画面難易度通常上級者初心者名前記録更新失敗成功判定得点時間'
+                '０１２３４５６７８９ＡＢＣＤＥ！？・ー「」')
+# NEC and IBM extensions. cp932 has them, plain Shift-JIS doesn't.
+cp932_chars = '①②③④⑤ⅠⅡⅢⅣ㈱№℡髙﨑'
+# JIS X 0213 additions, beyond cp932.
+x0213_chars = 'ㇰㇱㇲㇳㇴㇵㇶㇷㇸㇹㇺㇻㇼㇽㇾㇿ㋐㋑㋒'
+
+
+# Random bytes -> noise. Mostly zeros and low bytes like real code and data, with some high bytes that look like
+# Shift-JIS to keep the extractor honest.
+noise_table = bytes([0] * 154 + [0x20 + i for i in range(51)] + [0x80 + i * 2 for i in range(51)])
+
+
+def get_char_pool(encoding: str) -> str:
+    extras = {'sjis': '', 'cp932': cp932_chars, 'shift_jisx0213': x0213_chars}[encoding]
+    # Only keep what really encodes. Codec tables differ a bit between Python versions.
+    return ''.join(char for char in common_chars + extras if can_encode(char, encoding))
+
+
+def can_encode(char: str, encoding: str) -> bool:
+    try:
+        char.encode(codec_names[encoding])
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def generate_binary(output_path: str, size: int, encodings=('sjis', 'cp932', 'shift_jisx0213'), seed: int = 0,
+                    string_share: float = 0.3) -> dict:
+    """
+    Write a synthetic binary.
+    :param size: Bytes. The file ends up within one string of this.
+    :param string_share: Roughly how much of the file is strings. The rest is noise.
+    :return: Dictionary of every planted string to the encoding it was written in.
+    """
+    rng = random.Random(seed)
+    char_pools = {encoding: get_char_pool(encoding) for encoding in encodings}
+    planted = {}
+    written = 0
+    with open(output_path, 'wb') as output_file:
+        while written < size:
+            # Strings average about 24 bytes. Space them out to hit the string share.
+            noise_length = int(rng.expovariate(string_share / (1 - string_share) / 24))
+            noise = rng.randbytes(noise_length).translate(noise_table)
+            encoding = rng.choice(encodings)
+            text = ''.join(rng.choice(char_pools[encoding]) for _ in range(rng.randint(2, 20)))
+            planted[text] = encoding
+            chunk = noise + b'\x00' + text.encode(codec_names[encoding]) + b'\x00'
+            output_file.write(chunk)
+            written += len(chunk)
+    return planted
+
+
+def main():
+    output_path = sys.argv[1]
+    size_mb = float(sys.argv[2]) if len(sys.argv) > 2 else 8
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    planted = generate_binary(output_path, int(size_mb * 1024 * 1024), seed=seed)
+    print(f'Wrote {output_path}: {size_mb:,}MB, {len(planted):,} unique strings.')
+
+
+if __name__ == '__main__':
+    main()
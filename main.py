@@ -1,11 +1,13 @@
 import asyncio
 import logging
 import functools
+import os
 import sys
 
 from decouple import config
 
-from SjisMagic import DataProcessorService, DatabaseService, SjisExtractor, FileUtilities
+from SjisMagic import DataProcessorService, DatabaseService, SjisExtractor, FileUtilities, CacheService, \
+    StreamingPipeline, Metrics, ValidatorRegistry
 
 from utils import announce_status
 
@@ -27,6 +29,14 @@ async def main():
     # Let's get things setup
     setup_logging()
     DatabaseService.setup_db()
+    CacheService.setup_cache()
+
+    # Batch mode. A whole folder (or glob) of files, one .dict for each.
+    input_files, output_folder = fetch_batch_settings()
+    if input_files:
+        await run_batch(input_files, output_folder, config('TEXT_CODEC', default='shift_jisx0213'))
+        write_run_report()
+        return
 
     # Fetch our params
     input_file_path, output_file_path, text_codec = await fetch_settings()
@@ -37,35 +47,50 @@ async def main():
     # Ok. Time to get to work
     announce_status('Starting up')
 
-    # Extract strings from binary
-    extract = True
-    if not extract:
-        announce_status('Skipping extraction')
+    # Re-runs only extract changed files and only validate new strings. FULL_RERUN redoes everything.
+    # (e.g. after changing the validators)
+    full_rerun = config('FULL_RERUN', default=False, cast=bool)
+    if full_rerun:
+        DatabaseService.reset_validated()
+
+    # Nothing to stream if the file hasn't changed. The staged run skips extraction and picks up any leftovers.
+    if (config('STREAMING_PIPELINE', default=False, cast=bool) and
+            (full_rerun or not SjisExtractor.is_extracted(input_file_path, text_codec))):
+        # Everything at once. Translation starts as soon as the first chunk is scanned.
+        with Metrics.stage('stream'):
+            await StreamingPipeline.run_streaming_pipeline(input_file_path, text_codec, get_validators())
     else:
-        SjisExtractor.extract_strings(input_file_path, text_codec)
+        summary = await run_stages(input_file_path, text_codec, full_rerun)
+        announce_status(f"Strings: {summary['New']:,} new, {summary['Removed']:,} removed, "
+                        f"{summary['Unchanged']:,} unchanged")
+        Metrics.add_section('strings', {input_file_path: summary})
 
-    # Exclude stuff we don't want to translate
-    # All validations skip items that are already excluded. So do the slowest things last.
-    DataProcessorService.exclude_strings("Not Japanese Enough",
-                                         functools.partial(DataProcessorService.is_string_japanese_enough,
-                                                           min_jap_perc=50))
+    logger.info('Translation Complete!')
+    CacheService.log_stats()
 
-    DataProcessorService.exclude_strings("Not Variant Enough",
-                                         functools.partial(DataProcessorService.is_string_variant_enough,
-                                                           min_variety=50))
+    logger.info('Exporting .dict file...')
+    with Metrics.stage('export'):
+        FileUtilities.write_popnhax_dict(output_file_path, DatabaseService.get_source_file(input_file_path))
+    write_run_report()
+    logger.info('All done!')
 
-    DataProcessorService.exclude_strings("Too Many Repeating Chars",
-                                         functools.partial(DataProcessorService.is_string_nonrepeating,
-                                                           repetition_limit=5))
 
-    DataProcessorService.exclude_strings("Too Short",
-                                         functools.partial(DataProcessorService.is_string_long_enough, min_length=3))
+async def run_stages(input_file_path, text_codec, full_rerun=False) -> dict:
+    """
+    Run each stage to completion before starting the next.
+    :return: New/removed/unchanged string counts from extraction.
+    """
+    # Extract strings from binary. Skipped if the file is the same as last time.
+    with Metrics.stage('extract'):
+        summary = SjisExtractor.extract_strings(input_file_path, text_codec, force=full_rerun)
 
-    # DataProcessorService.exclude_strings("Half Width Latin Chars",
-    #                                     functools.partial(DataProcessorService.are_latin_chars_fullwidth))
+    # Exclude stuff we don't want to translate
+    DataProcessorService.exclude_strings_via_validators(get_validators())
 
-    # This takes way longer than our other validations. Make sure to do it last.
-    # exclude_unfindable_strings(input_file_path, text_codec)
+    # Sanity check. Anything we can't find in the source file got mangled somewhere along the way.
+    with Metrics.stage('source check'):
+        DataProcessorService.exclude_unfindable_strings(input_file_path, text_codec)
+    DatabaseService.mark_all_validated()
 
     # Pop'n doesn't like half width latin chars.
     # DataProcessorService.convert_everythings_width("standard")
@@ -73,16 +98,80 @@ async def main():
     # How many things are we actually gonna spend money/time on?
     announce_status(f'{DatabaseService.get_untranslated_items_count():,} phrases left to translate')
 
-    # We work in batches for performance
-    await DataProcessorService.crank_up_translation_machine(10)
+    # We work in batches for monitoring. How many run at once is set per brain. (e.g. OLLAMA_MAX_IN_FLIGHT)
+    with Metrics.stage('translate'):
+        await DataProcessorService.crank_up_translation_machine(100)
+    return summary
 
-    logger.info('Translation Complete!')
 
-    logger.info('Exporting .dict file...')
-    FileUtilities.write_popnhax_dict(output_file_path)
+async def run_batch(input_pattern, output_folder, text_codec):
+    """
+    Stages, for a batch of files. Strings are shared between the files, so each one gets validated and translated
+    once, however many files it's in.
+    """
+    input_file_paths = FileUtilities.find_input_files(input_pattern)
+    if not input_file_paths:
+        logger.warning(f'No files found for: {input_pattern}')
+        return
+
+    dict_file_paths = FileUtilities.get_dict_file_paths(input_file_paths, output_folder)
+    for input_file_path, dict_file_path in dict_file_paths.items():
+        logger.info(f"Extracting: {input_file_path} Creating: {dict_file_path}")
+    logger.info(f'Codec: {text_codec}')
+    announce_status(f'Starting up batch of {len(input_file_paths):,} files')
+
+    full_rerun = config('FULL_RERUN', default=False, cast=bool)
+    if full_rerun:
+        DatabaseService.reset_validated()
+
+    with Metrics.stage('extract'):
+        summaries = SjisExtractor.extract_strings_from_files(input_file_paths, text_codec, force=full_rerun)
+    Metrics.add_section('strings', summaries)
+    DataProcessorService.exclude_strings_via_validators(get_validators())
+    with Metrics.stage('source check'):
+        DataProcessorService.exclude_unfindable_strings_in_files(input_file_paths, text_codec)
+    DatabaseService.mark_all_validated()
+
+    announce_status(f'{DatabaseService.get_untranslated_items_count():,} phrases left to translate')
+    with Metrics.stage('translate'):
+        await DataProcessorService.crank_up_translation_machine(100)
+
+    logger.info('Translation Complete!')
+    CacheService.log_stats()
+
+    logger.info('Exporting .dict files...')
+    os.makedirs(output_folder, exist_ok=True)
+    for input_file_path, dict_file_path in dict_file_paths.items():
+        summary = summaries[input_file_path]
+        logger.info(f"{input_file_path}: {summary['New']:,} new, {summary['Removed']:,} removed, "
+                    f"{summary['Unchanged']:,} unchanged strings.")
+        with Metrics.stage('export'):
+            FileUtilities.write_popnhax_dict(dict_file_path, DatabaseService.get_source_file(input_file_path))
     logger.info('All done!')
 
 
+def get_validators():
+    # Strings stop at the first validator they fail. The order here doesn't matter much, they get run cheapest per
+    # rejection first. (ADAPTIVE_VALIDATOR_ORDER=False runs them in this order.)
+    if not ValidatorRegistry.get_registered():
+        ValidatorRegistry.register("Not Japanese Enough", functools.partial(
+            DataProcessorService.is_string_japanese_enough, min_jap_perc=50))
+        ValidatorRegistry.register("Not Variant Enough", functools.partial(
+            DataProcessorService.is_string_variant_enough, min_variety=50))
+        ValidatorRegistry.register("Too Many Repeating Chars", functools.partial(
+            DataProcessorService.is_string_nonrepeating, repetition_limit=5))
+        ValidatorRegistry.register("Too Short", functools.partial(
+            DataProcessorService.is_string_long_enough, min_length=3))
+        # ValidatorRegistry.register("Half Width Latin Chars", DataProcessorService.are_latin_chars_fullwidth)
+    return ValidatorRegistry.get_registered()
+
+
+def write_run_report():
+    # Timings, provider stats and the rest end up in RUN_REPORT_PATH, for comparing runs.
+    Metrics.add_section('cache', dict(CacheService.stats))
+    Metrics.write_report()
+
+
 async def fetch_settings():
     text_codec = config('TEXT_CODEC', default='shift_jisx0213')
     input_file_path = config('INPUT_FILE_PATH', default='working/popn22.dll')
@@ -90,11 +179,18 @@ async def fetch_settings():
     return input_file_path, output_file_path, text_codec
 
 
-def setup_logging():
+def fetch_batch_settings():
+    # INPUT_FILES can be a folder or a glob. Leave it empty to work on INPUT_FILE_PATH.
+    input_files = config('INPUT_FILES', default='')
+    output_folder = config('OUTPUT_FOLDER', default='working')
+    return input_files, output_folder
+
+
+def setup_logging(log_file_path="sjismagic.log"):
     log_formatter = logging.Formatter(fmt="{levelname:<7}| {name} | {message}", style="{")
     root_logger = logging.getLogger()
     # Logger won't write our fancy characters if we don't give it a robust encoding.
-    file_handler = logging.FileHandler("sjismagic.log", encoding="utf-8", mode="w+")
+    file_handler = logging.FileHandler(log_file_path, encoding="utf-8", mode="w+")
     file_handler.setFormatter(log_formatter)
     root_logger.addHandler(file_handler)
     console_handler = logging.StreamHandler(sys.stdout)
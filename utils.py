@@ -1,9 +1,13 @@
+import json
 import logging
 
 # Let's setup some logging!
 logger = logging.getLogger('status')
 logger.setLevel(logging.INFO)
 
+# What the prompts tell the brains to answer with when there's nothing to translate. (Ollama's say 'XXX'.)
+placeholder_translations = {'NNN', 'PPP', 'CCC', 'XXX'}
+
 
 def announce_status(status: str):
     length = len(status) + 7
@@ -11,3 +15,45 @@ def announce_status(status: str):
     logger.info('*'.ljust(length, '*'))
     logger.info(f'*  {status.capitalize()}!  *')
     logger.info(''.ljust(length, '*'))
+
+
+def is_placeholder(translation: str) -> bool:
+    return translation.strip() in placeholder_translations
+
+
+def build_batch_prompt(texts: list) -> str:
+    """
+    Build the user prompt for translating several phrases in one request.
+    """
+    phrases = json.dumps(texts, ensure_ascii=False)
+    return (f'Translate each of these phrases: {phrases}\n'
+            f'Each translation must not be longer than its original phrase. Return every phrase in the '
+            f'translations list, with "original" copied exactly as given.')
+
+
+def build_context_prompt(similar: list) -> str:
+    """
+    Build a prompt addition showing how similar phrases were translated before.
+    :param similar: (original, translation, similarity) tuples
+    """
+    if not similar:
+        return ''
+    examples = json.dumps([{"original": original, "translation": translation}
+                           for original, translation, _ in similar], ensure_ascii=False)
+    return f'\nFor consistency, similar phrases were translated like this: {examples}'
+
+
+def parse_response_to_dic(response_text):
+    # Parse the json we received into a dictionary
+    json_array = json.loads(response_text)
+    translation_dic = {}
+
+    for item in json_array["translations"]:
+        # Models occasionally drop a key. Skip the item, the phrase will get retried.
+        if "original" not in item or "translation" not in item:
+            logger.debug(f"Skipping incomplete item: {item}")
+            continue
+        translation_dic[item["original"]] = item["translation"]
+
+    logger.debug(f"Translated: {translation_dic}")
+    return translation_dic
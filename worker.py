@@ -0,0 +1,35 @@
+import asyncio
+import logging
+import os
+import socket
+
+from decouple import config
+
+from SjisMagic import DataProcessorService, DatabaseService, CacheService
+from main import setup_logging
+
+# Let's setup some logging!
+logger = logging.getLogger('worker')
+logger.setLevel(logging.INFO)
+
+
+async def run_worker():
+    """
+    Translate whatever main.py left in the DB, alongside any number of other workers. Start as many as your
+    provider can handle, on the machine the DB lives on. (WAL mode needs shared memory, so the DB can't be shared
+    over a network drive.) Each one leases its own rows, so nothing gets translated twice.
+    """
+    setup_logging(f"sjismagic-worker-{os.getpid()}.log")
+    DatabaseService.setup_db()
+    CacheService.setup_cache()
+
+    worker_id = config('WORKER_ID', default=f'{socket.gethostname()}-{os.getpid()}')
+    brain = DataProcessorService.Brain[config('WORKER_BRAIN', default='Ollama')]
+    await DataProcessorService.run_translation_worker(worker_id, brain,
+                                                      lease_size=config('LEASE_SIZE', default=50, cast=int),
+                                                      lease_seconds=config('LEASE_SECONDS', default=600, cast=int))
+    CacheService.log_stats()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())